@@ -0,0 +1,271 @@
+"""
+Load test of the API, run with `python -m benchmarks.load_test`.
+
+Boots create_app() in process behind an httpx ASGI client, seeds users and friendships, then drives every
+endpoint with concurrent clients and prints req/s, p50/p95/p99 latency and SQL statements per request as JSON.
+Without --database-url it runs against a fresh SQLite file. A Postgres database must already be at
+`alembic upgrade head`; the seeded rows are prefixed with a run id so repeated runs don't collide.
+
+Pass --baseline with the JSON of an earlier run to exit with status 1 when an endpoint regressed.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+PASSWORD = "benchmark1!"
+
+ENDPOINTS = ["token", "users_me", "users", "users_search", "friends", "friend_requests", "friend_stats", "friends_log"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None, help="Database to run against (default: a fresh SQLite file)")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="Run with DATABASE_ASYNC enabled")
+    parser.add_argument("--users", type=int, default=10_000, help="Users to seed")
+    parser.add_argument("--friends", type=int, default=20, help="Accepted friendships per user, on average")
+    parser.add_argument("--pending", type=int, default=5, help="Pending requests received per user, on average")
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=2_000, help="Requests per endpoint")
+    parser.add_argument("--token-requests", type=int, default=200, help="Requests to /token/, which runs bcrypt")
+    parser.add_argument("--logged-in", type=int, default=100, help="Users the clients are logged in as")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the data and the request mix")
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", type=Path, default=None, help="JSON report of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative increase of p95 latency and of statements per request")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """
+    Point the settings at the benchmark database. Must run before anything from src is imported.
+    """
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        path = Path("/tmp/atrium-benchmark.sqlite")
+        path.unlink(missing_ok=True)
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        os.environ["DATABASE_STARTUP"] = "create"
+
+    os.environ["DATABASE_ASYNC"] = "true" if args.async_mode else "false"
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    os.environ.setdefault("JWT_ALGORITHM", "HS256")
+    os.environ.setdefault("JWT_EXPIRATION", "60")
+    # Every client logs in from the same address, the login limits would turn most of them away
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+
+def seed(args, run: str) -> List[str]:
+    """
+    Insert the users and friendships straight into the database, all with the same password hash, then
+    recompute the friendship counters, which the inserts bypass.
+    The first user is an admin, so it can read the friendships log, and about 5% of the others are inactive.
+    Returns the usernames of the active users, the admin first.
+    """
+    from sqlalchemy import insert
+
+    from src.core.security import pwd_context
+    from src.crud.stats import reconcile_friendship_stats
+    from src.database.session import SessionLocal
+    from src.models.friends import Friendship, FriendshipStatus, canonical_pair
+    from src.models.user import User, Role, State, ProfileType
+
+    rng = random.Random(args.seed)
+    password = pwd_context.hash(PASSWORD)
+    usernames = [f"bench{run}u{i}" for i in range(args.users)]
+    ids = [uuid.uuid4() for _ in usernames]
+
+    users = [dict(id=user_id, firstname="Bench", lastname="User", username=username, email=f"{username}@example.com",
+                  password=password, role=Role.ADMIN if i == 0 else Role.USER,
+                  state=State.ACTIVE if i == 0 or rng.random() > 0.05 else State.INACTIVE, type=ProfileType.PUBLIC)
+             for i, (user_id, username) in enumerate(zip(ids, usernames))]
+
+    pairs = set()
+    friendships = []
+    now = datetime.now()
+    for count, status in ((args.users * args.friends // 2, FriendshipStatus.ACCEPTED),
+                          (args.users * args.pending, FriendshipStatus.PENDING)):
+        added, draws = 0, 0
+        # Stop after twice as many draws as wanted, so a dense graph can't loop forever
+        while added < count and draws < count * 2:
+            draws += 1
+            sender, receiver = rng.sample(ids, 2)
+            pair = canonical_pair(sender, receiver)
+            if pair in pairs:
+                continue
+            pairs.add(pair)
+            friendships.append(dict(id=uuid.uuid4(), created=now, user_id=sender, receiver_id=receiver,
+                                    pair_low_id=pair[0], pair_high_id=pair[1], status=status,
+                                    responded=now if status == FriendshipStatus.ACCEPTED else None))
+            added += 1
+
+    with SessionLocal() as db:
+        for table, rows in ((User, users), (Friendship, friendships)):
+            for start in range(0, len(rows), 5_000):
+                db.execute(insert(table), rows[start:start + 5_000])
+        db.commit()
+        reconcile_friendship_stats(db)
+
+    return [user["username"] for user in users if user["state"] == State.ACTIVE]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+async def measure(client, requests: int, concurrency: int, make_request: Callable) -> Dict:
+    """
+    Send `requests` requests from `concurrency` clients and summarize latencies and statement counts.
+    """
+    from src.database.instrumentation import track_queries
+
+    latencies: List[float] = []
+    statements: List[int] = []
+    status_codes: Dict[str, int] = {}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            # The ASGI transport runs the app in this task, so the request's statements add up here too
+            with track_queries() as stats:
+                start = time.perf_counter()
+                try:
+                    response = await make_request(client)
+                    status = str(response.status_code)
+                except Exception as error:
+                    status = type(error).__name__
+                latencies.append(time.perf_counter() - start)
+            statements.append(stats.statements)
+            status_codes[status] = status_codes.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "status_codes": status_codes,
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "sql_per_request": round(sum(statements) / len(statements), 2),
+        "sql_max": max(statements),
+    }
+
+
+async def run(args) -> Dict:
+    import httpx
+
+    from main import create_app
+    from src.core.config import settings
+    from src.crud.friends import load_friend_graph
+    from src.database.session import engine, run_in_session
+
+    # Request logging would dominate the measurements
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    app = create_app()
+    rng = random.Random(args.seed)
+    api = settings.API_V1_STR
+    run_id = uuid.uuid4().hex[:8]
+
+    async with app.router.lifespan_context(app):
+        usernames = seed(args, run_id)
+        if settings.FRIEND_GRAPH_ENABLED:
+            await run_in_session(load_friend_graph)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            async def login(username: str):
+                response = await client.post(f"{api}/token/", data=dict(username=username, password=PASSWORD))
+                response.raise_for_status()
+                return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            logged_in = rng.sample(usernames[1:], min(args.logged_in, len(usernames) - 1))
+            headers = [await login(username) for username in logged_in]
+            admin = await login(usernames[0])
+
+            requests = {
+                "token": lambda c: c.post(f"{api}/token/",
+                                          data=dict(username=rng.choice(logged_in), password=PASSWORD)),
+                "users_me": lambda c: c.get(f"{api}/users/me", headers=rng.choice(headers)),
+                "users": lambda c: c.get(f"{api}/users/", headers=rng.choice(headers)),
+                "users_search": lambda c: c.get(f"{api}/users/", headers=rng.choice(headers),
+                                                params=dict(search_type="username",
+                                                            search_query=f"u{rng.randrange(args.users)}")),
+                "friends": lambda c: c.get(f"{api}/friends/", headers=rng.choice(headers)),
+                "friend_requests": lambda c: c.get(f"{api}/friends/requests", headers=rng.choice(headers)),
+                "friend_stats": lambda c: c.get(f"{api}/friends/stats", headers=rng.choice(headers)),
+                "friends_log": lambda c: c.get(f"{api}/friends/log", headers=admin),
+            }
+
+            results = {}
+            for name in args.endpoints:
+                count = args.token_requests if name == "token" else args.requests
+                results[name] = await measure(client, count, args.concurrency, requests[name])
+
+    return {
+        "config": {
+            "database": engine.dialect.name,
+            "async": args.async_mode,
+            "users": args.users,
+            "friends": args.friends,
+            "pending": args.pending,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        "endpoints": results,
+    }
+
+
+def regressions(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Compare a report with an earlier one, listing every endpoint whose p95 latency or statement count grew too much.
+    """
+    found = []
+    for name, result in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        for metric in ("p95_ms", "sql_per_request"):
+            if result[metric] > before[metric] * (1 + tolerance) + 1e-9:
+                found.append(f"{name}: {metric} went from {before[metric]} to {result[metric]}")
+    return found
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        found = regressions(report, json.loads(args.baseline.read_text()), args.max_regression)
+        for regression in found:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Latency of the other endpoints during a credential-stuffing burst, run with `python -m benchmarks.login_flood`.
+
+Boots create_app() in process like the load test and measures GET /users/me and GET /friends/ three times:
+without an attack, while wrong passwords for existing users are posted to /token/ at --attack-rate attempts
+a second from --attacker-ips addresses with the rate limits off, and the same with them on. The attack keeps
+its rate whatever the answers take, like a botnet would, up to --attack-concurrency unanswered attempts. Prints the three measurements,
+with the status codes the attack got, as JSON. With the limits on, the attack is answered with 429 before
+it reaches bcrypt, so the latencies should stay close to the ones without an attack.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict
+
+from benchmarks.load_test import PASSWORD, configure_environment, measure, seed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None, help="Database to run against (default: a fresh SQLite file)")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="Run with DATABASE_ASYNC enabled")
+    parser.add_argument("--users", type=int, default=2_000, help="Users to seed")
+    parser.add_argument("--attack-rate", type=int, default=100, help="Login attempts a second during the attack")
+    parser.add_argument("--attack-concurrency", type=int, default=200,
+                        help="Attempts waiting for an answer at most, the attack slows down past it")
+    parser.add_argument("--attacker-ips", type=int, default=5, help="Addresses the attack comes from")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients of the measured endpoints")
+    parser.add_argument("--requests", type=int, default=1_000, help="Requests per measured endpoint and phase")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the data and the request mix")
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+async def run(args) -> Dict:
+    import httpx
+
+    from main import create_app
+    from src.core.config import settings
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    app = create_app()
+    rng = random.Random(args.seed)
+    api = settings.API_V1_STR
+
+    async with app.router.lifespan_context(app):
+        usernames = seed(SimpleNamespace(users=args.users, friends=20, pending=5, seed=args.seed),
+                         uuid.uuid4().hex[:8])
+
+        def client(ip: str) -> httpx.AsyncClient:
+            return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(ip, 50000)),
+                                     base_url="http://benchmark", timeout=None)
+
+        async with client("10.0.0.1") as user_client:
+            settings.RATE_LIMIT_ENABLED = False
+            headers = []
+            for username in usernames[1:21]:
+                response = await user_client.post(f"{api}/token/", data=dict(username=username, password=PASSWORD))
+                response.raise_for_status()
+                headers.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+
+            requests = {
+                "users_me": lambda c: c.get(f"{api}/users/me", headers=rng.choice(headers)),
+                "friends": lambda c: c.get(f"{api}/friends/", headers=rng.choice(headers)),
+            }
+
+            async def phase(attack: bool, rate_limited: bool) -> Dict:
+                settings.RATE_LIMIT_ENABLED = rate_limited
+                status_codes: Dict[str, int] = {}
+                stop = asyncio.Event()
+
+                async def attempt(attack_client: httpx.AsyncClient):
+                    response = await attack_client.post(f"{api}/token/", data=dict(
+                        username=rng.choice(usernames), password="wrong password"))
+                    status = str(response.status_code)
+                    status_codes[status] = status_codes.get(status, 0) + 1
+
+                async def attacker():
+                    clients = [client(f"203.0.113.{i + 1}") for i in range(args.attacker_ips)]
+                    in_flight = set()
+                    loop = asyncio.get_running_loop()
+                    next_attempt = loop.time()
+                    while not stop.is_set():
+                        if len(in_flight) >= args.attack_concurrency:
+                            await asyncio.sleep(0.01)
+                            continue
+                        task = asyncio.create_task(attempt(rng.choice(clients)))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+                        next_attempt = max(next_attempt + 1 / args.attack_rate, loop.time() - 1)
+                        await asyncio.sleep(max(0.0, next_attempt - loop.time()))
+                    await asyncio.gather(*in_flight)
+                    for attack_client in clients:
+                        await attack_client.aclose()
+
+                attack_task = asyncio.create_task(attacker()) if attack else None
+                try:
+                    results = {name: await measure(user_client, args.requests, args.concurrency, request)
+                               for name, request in requests.items()}
+                finally:
+                    stop.set()
+                    if attack_task:
+                        await attack_task
+                if attack:
+                    results["attack_status_codes"] = status_codes
+                return results
+
+            return {
+                "config": {"users": args.users, "attack_rate": args.attack_rate, "attacker_ips": args.attacker_ips,
+                           "concurrency": args.concurrency, "requests": args.requests},
+                "no_attack": await phase(attack=False, rate_limited=True),
+                "attack_unlimited": await phase(attack=True, rate_limited=False),
+                "attack_rate_limited": await phase(attack=True, rate_limited=True),
+            }
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    output = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
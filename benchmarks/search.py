@@ -0,0 +1,176 @@
+"""
+Username and email search over a million users, pg_trgm against plain ILIKE, run with
+`python -m benchmarks.search --database-url postgresql://...`.
+
+Seeds --users users with the load test's seeding into a Postgres database at `alembic upgrade head`, then
+times the same searches, one at a time, on two paths:
+
+- trigram: TrigramSearchBackend, the path search_user takes on Postgres. The pg_trgm GIN indexes serve the
+  ILIKE filter and the matches are ranked by similarity().
+- ilike: the query search_user ran before the trigram search, `ILIKE '%value%'` returning the first match,
+  with bitmap scans off so the GIN indexes can't serve it, as on a database without them.
+
+Searched values are one user's number (a few matches), a two digit number (about 1% of the users) and a value
+matching nobody, against usernames and emails. Prints p50/p95/p99 latency, average rows returned and the plan
+of each path as JSON. Pass --run-id of an earlier run to search its users again instead of seeding more.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from benchmarks.load_test import configure_environment, percentile, seed
+
+KINDS = ["user", "broad", "miss"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="Postgres database to run against")
+    parser.add_argument("--users", type=int, default=1_000_000, help="Users to seed")
+    parser.add_argument("--run-id", default=None, help="Search the users seeded by an earlier run instead")
+    parser.add_argument("--queries", type=int, default=200, help="Searches per column, kind and path")
+    parser.add_argument("--limit", type=int, default=20, help="Page size of the trigram search")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the data and the searched values")
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def search_values(kind: str, run: str, users: int, rng: random.Random) -> Callable[[], str]:
+    # Usernames are bench{run}u{i} and emails the same at example.com
+    if kind == "user":
+        return lambda: f"{run}u{rng.randrange(users)}"
+    if kind == "broad":
+        return lambda: f"{run}u{rng.randrange(10, 100)}"
+    return lambda: f"{run}x{rng.randrange(users)}"
+
+
+def trigram_search(db, column, value: str, limit: int) -> int:
+    from src.crud.search import TrigramSearchBackend
+    from src.models.user import State, User
+
+    query = db.query(User).filter(User.state == State.ACTIVE)
+    users, _ = TrigramSearchBackend().search(db, query, column, value, None, limit)
+    return len(users)
+
+
+def ilike_search(db, column, value: str, limit: int) -> int:
+    from sqlalchemy import text
+
+    from src.models.user import State, User
+
+    db.execute(text("SET LOCAL enable_bitmapscan = off"))
+    user = db.query(User).filter(User.state == State.ACTIVE).filter(column.ilike(f"%{value}%")).first()
+    return int(user is not None)
+
+
+PATHS = {"trigram": trigram_search, "ilike": ilike_search}
+
+
+def plan(path: str, column, value: str) -> List[str]:
+    """
+    The scan nodes Postgres plans for a path's filter, with the index they use if any.
+    """
+    from sqlalchemy import text
+
+    from src.database.session import SessionLocal
+
+    with SessionLocal() as db:
+        if path == "ilike":
+            db.execute(text("SET LOCAL enable_bitmapscan = off"))
+        explained = db.execute(text(f"EXPLAIN (FORMAT JSON) SELECT id FROM users WHERE {column.key} ILIKE :pattern"),
+                               dict(pattern=f"%{value}%")).scalar()
+        db.rollback()
+
+    nodes, pending = [], [explained[0]["Plan"]]
+    while pending:
+        node = pending.pop()
+        if "Scan" in node["Node Type"]:
+            nodes.append(" on ".join(filter(None, [node["Node Type"], node.get("Index Name")])))
+        pending.extend(node.get("Plans", []))
+    return nodes
+
+
+def measure(path: str, column, values: Callable[[], str], queries: int, limit: int) -> Dict:
+    """
+    Run `queries` searches on a path, each in its own session, and summarize latencies and rows returned.
+    """
+    from src.database.session import SessionLocal
+
+    latencies: List[float] = []
+    rows = 0
+    for _ in range(queries):
+        value = values()
+        with SessionLocal() as db:
+            start = time.perf_counter()
+            rows += PATHS[path](db, column, value, limit)
+            latencies.append(time.perf_counter() - start)
+            db.rollback()
+
+    latencies.sort()
+    return {
+        "queries": queries,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "rows_per_query": round(rows / queries, 2),
+    }
+
+
+def run(args) -> Dict:
+    from sqlalchemy import text
+
+    from src.database.session import SessionLocal, engine
+    from src.models.user import User
+
+    if engine.dialect.name != "postgresql":
+        sys.exit(f"pg_trgm needs Postgres, --database-url points at {engine.dialect.name}")
+
+    run_id = args.run_id
+    if run_id is None:
+        run_id = uuid.uuid4().hex[:8]
+        seed(SimpleNamespace(users=args.users, friends=0, pending=0, seed=args.seed), run_id)
+        # Fresh statistics, so the planner knows the size of the table it is choosing a scan for
+        with SessionLocal() as db:
+            db.execute(text("ANALYZE users"))
+            db.commit()
+
+    rng = random.Random(args.seed)
+    results = {}
+    for column in (User.username, User.email):
+        for kind in KINDS:
+            values = search_values(kind, run_id, args.users, rng)
+            result = {}
+            for path in PATHS:
+                # Warm the buffer cache and the connection pool before timing
+                measure(path, column, values, min(10, args.queries), args.limit)
+                result[path] = {**measure(path, column, values, args.queries, args.limit),
+                                "plan": plan(path, column, values())}
+            results[f"{column.key}_{kind}"] = result
+
+    return {
+        "config": {"users": args.users, "run_id": run_id, "queries": args.queries, "limit": args.limit,
+                   "seed": args.seed},
+        "searches": results,
+    }
+
+
+def main():
+    args = parse_args()
+    configure_environment(SimpleNamespace(database_url=args.database_url, async_mode=False))
+
+    output = json.dumps(run(args), indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
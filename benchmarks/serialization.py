@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of list response serialization, run with `python -m benchmarks.serialization`.
+
+Compares the previous path (build models per row, strftime dates, jsonable_encoder + JSONResponse)
+with the current one (validate from ORM rows, TypeAdapter.dump_json straight to bytes).
+"""
+
+import argparse
+import time
+import uuid
+from datetime import datetime
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from src.crud.friends import format_timestamp
+from src.models.friends import Friendship, FriendshipStatus
+from src.models.user import User, Role, State, ProfileType
+from src.schemas.friends import FriendRequestResponse
+from src.schemas.page import Page
+from src.schemas.user import UserResponse
+
+
+def make_users(count: int):
+    return [User(id=uuid.uuid4(), firstname="John", lastname="Doe", username=f"johndoe{i}",
+                 email=f"johndoe{i}@example.com", role=Role.USER, state=State.ACTIVE, type=ProfileType.PUBLIC)
+            for i in range(count)]
+
+
+def make_friendships(users: List[User]):
+    now = datetime.now()
+    return [Friendship(id=uuid.uuid4(), user_id=sender.id, receiver_id=receiver.id, created=now, responded=now,
+                       status=FriendshipStatus.ACCEPTED)
+            for sender, receiver in zip(users, users[1:] + users[:1])]
+
+
+def users_before(users):
+    items = [UserResponse(id=user.id, firstname=user.firstname, lastname=user.lastname, username=user.username,
+                          email=user.email, role=user.role, state=user.state, type=user.type)
+             for user in users]
+    return JSONResponse(jsonable_encoder(Page[UserResponse](items=items, next_cursor=None))).body
+
+
+user_page_adapter = TypeAdapter(Page[UserResponse])
+
+
+def users_after(users):
+    return user_page_adapter.dump_json(Page[UserResponse].model_validate(
+        {"items": users, "next_cursor": None}, from_attributes=True))
+
+
+def friendships_before(friendships, users):
+    responses = {user.id: UserResponse(id=user.id, firstname=user.firstname, lastname=user.lastname,
+                                       username=user.username, email=user.email, role=user.role,
+                                       state=user.state, type=user.type)
+                 for user in users}
+    items = [FriendRequestResponse(id=friendship.id, created=friendship.created.strftime("%H:%M:%S %d-%m-%Y"),
+                                   sender=responses[friendship.user_id], receiver=responses[friendship.receiver_id],
+                                   status=friendship.status,
+                                   responded=friendship.responded.strftime("%H:%M:%S %d-%m-%Y"))
+             for friendship in friendships]
+    return JSONResponse(jsonable_encoder(items)).body
+
+
+friend_request_list_adapter = TypeAdapter(List[FriendRequestResponse])
+
+
+def friendships_after(friendships, users):
+    responses = {user.id: UserResponse.model_validate(user) for user in users}
+    items = [FriendRequestResponse(id=friendship.id, created=format_timestamp(friendship.created),
+                                   sender=responses[friendship.user_id], receiver=responses[friendship.receiver_id],
+                                   status=friendship.status, responded=format_timestamp(friendship.responded))
+             for friendship in friendships]
+    return friend_request_list_adapter.dump_json(items)
+
+
+def best_of(fn, *args, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    users = make_users(args.rows)
+    friendships = make_friendships(users)
+
+    for name, before, after, fn_args in (("users", users_before, users_after, (users,)),
+                                         ("friend requests", friendships_before, friendships_after,
+                                          (friendships, users))):
+        old = best_of(before, *fn_args, repeat=args.repeat)
+        new = best_of(after, *fn_args, repeat=args.repeat)
+        print(f"{args.rows} {name}: before {old * 1000:.1f} ms, after {new * 1000:.1f} ms, {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
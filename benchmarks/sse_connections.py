@@ -0,0 +1,225 @@
+"""
+Idle event streams per worker, run with `python -m benchmarks.sse_connections`.
+
+Starts one uvicorn worker on a fresh SQLite file, opens --connections streams to GET /friends/events and keeps
+them idle, then prints as JSON: the worker's memory per stream, how long opening them took, whether every stream
+got a heartbeat, the latency of GET /users/me with and without the streams open, and how long friend requests
+take from POST /friends/requests to the receiver's stream.
+
+Each stream is a socket in the worker and one in this process, so the open file limit must be above twice
+--connections; the soft limit is raised to the hard one. The default is the 50k streams a worker is sized for.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List
+
+from benchmarks.load_test import configure_environment, percentile, seed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=50_000, help="Event streams to open")
+    parser.add_argument("--users", type=int, default=1_000, help="Users the streams are spread over")
+    parser.add_argument("--events", type=int, default=200, help="Friend requests sent to measure delivery")
+    parser.add_argument("--heartbeat", type=int, default=10, help="EVENTS_HEARTBEAT_SECONDS of the worker")
+    parser.add_argument("--opening-concurrency", type=int, default=500, help="Streams being opened at a time")
+    parser.add_argument("--port", type=int, default=0, help="Port of the worker (default: a free one)")
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: int) -> int:
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+
+def seed_users(users: int) -> List[uuid.UUID]:
+    """
+    Seed the users and return their ids. The load test's seeding with no friendships, everyone active.
+    """
+    from sqlalchemy import select, update
+
+    from src.database.session import SessionLocal
+    from src.models.user import User, State
+
+    run = uuid.uuid4().hex[:8]
+    seed(SimpleNamespace(users=users, friends=0, pending=0, seed=0), run)
+    with SessionLocal() as db:
+        db.execute(update(User).values(state=State.ACTIVE))
+        db.commit()
+        return list(db.scalars(select(User.id).order_by(User.username)))
+
+
+def start_worker(args, port: int) -> subprocess.Popen:
+    env = dict(os.environ, EVENTS_HEARTBEAT_SECONDS=str(args.heartbeat),
+               EVENTS_MAX_CONNECTIONS=str(args.connections + 100))
+    worker = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                               "--port", str(port), "--no-access-log", "--log-level", "warning",
+                               "--backlog", "4096", "--timeout-graceful-shutdown", "1"], env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return worker
+        except OSError:
+            time.sleep(0.2)
+    worker.kill()
+    raise RuntimeError("The worker didn't start")
+
+
+class Stream:
+    """
+    One idle event stream, read by its own task.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.heartbeats = 0
+        self.events: Dict[str, float] = {}
+
+    async def read(self):
+        event = None
+        while line := await self.reader.readline():
+            # Chunked transfer encoding: skip the chunk sizes, the frames are made of the other lines
+            line = line.decode().rstrip("\r\n")
+            if line.startswith(":"):
+                self.heartbeats += 1
+            elif line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event:
+                self.events[json.loads(line[len("data: "):])["id"]] = time.perf_counter()
+                event = None
+
+
+async def open_stream(port: int, token: str) -> Stream:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET /api/v1/friends/events HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n"
+                 f"Authorization: Bearer {token}\r\n\r\n".encode())
+    await writer.drain()
+    status = await reader.readline()
+    if b" 200 " not in status:
+        raise RuntimeError(f"Opening a stream failed: {status.decode().strip()}")
+    while await reader.readline() not in (b"\r\n", b""):
+        pass
+    return Stream(reader, writer)
+
+
+async def users_me_latency(client, token: str, requests: int = 200) -> Dict[str, float]:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get("/api/v1/users/me", headers={"Authorization": f"Bearer {token}"})
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {"p50_ms": round(percentile(latencies, 0.5), 2), "p99_ms": round(percentile(latencies, 0.99), 2)}
+
+
+async def run(args, port: int, worker: subprocess.Popen, user_ids: List[uuid.UUID]) -> Dict:
+    import httpx
+
+    from src.core.authentication import create_access_token
+    from src.models.user import ProfileType, Role, State
+
+    tokens = [create_access_token(SimpleNamespace(id=user_id, role=Role.USER, state=State.ACTIVE,
+                                                  type=ProfileType.PUBLIC)) for user_id in user_ids]
+    # The last user only sends the friend requests, the streams belong to the others
+    sender_token, receivers = tokens[-1], tokens[:-1]
+    report: Dict = {"connections": args.connections}
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+        await users_me_latency(client, sender_token, 20)
+        report["users_me_idle"] = await users_me_latency(client, sender_token)
+        rss_before = rss_bytes(worker.pid)
+
+        streams: List[Stream] = []
+        opening = asyncio.Semaphore(args.opening_concurrency)
+
+        async def open_one(i: int):
+            async with opening:
+                streams.append(await open_stream(port, receivers[i % len(receivers)]))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(open_one(i) for i in range(args.connections)))
+        report["open_seconds"] = round(time.perf_counter() - start, 2)
+        readers = [asyncio.create_task(stream.read()) for stream in streams]
+
+        await asyncio.sleep(args.heartbeat * 1.5)
+        report["streams_with_heartbeat"] = sum(1 for stream in streams if stream.heartbeats)
+        report["worker_rss_mb"] = round(rss_bytes(worker.pid) / 2 ** 20, 1)
+        report["rss_per_stream_kb"] = round((rss_bytes(worker.pid) - rss_before) / args.connections / 1024, 2)
+        report["users_me_with_streams"] = await users_me_latency(client, sender_token)
+
+        sent: Dict[str, float] = {}
+        for i in range(min(args.events, len(receivers))):
+            start = time.perf_counter()
+            response = await client.post("/api/v1/friends/requests", params={"receiver_id": str(user_ids[i])},
+                                         headers={"Authorization": f"Bearer {sender_token}"})
+            response.raise_for_status()
+            sent[response.json()["id"]] = start
+        await asyncio.sleep(1)
+
+        delivery = sorted((received - sent[event_id]) * 1000
+                          for stream in streams for event_id, received in stream.events.items() if event_id in sent)
+        expected = sum(1 for i in range(args.connections) if i % len(receivers) < len(sent))
+        report["events"] = {"sent": len(sent), "expected_deliveries": expected, "delivered": len(delivery)}
+        if delivery:
+            report["events"].update(p50_ms=round(percentile(delivery, 0.5), 2),
+                                    p99_ms=round(percentile(delivery, 0.99), 2))
+
+        for task in readers:
+            task.cancel()
+        for stream in streams:
+            stream.writer.close()
+
+    return report
+
+
+def main():
+    args = parse_args()
+    configure_environment(SimpleNamespace(database_url=None, async_mode=False))
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if hard < args.connections * 2 + 1_000:
+        sys.exit(f"The open file limit is {hard}, {args.connections} streams need about {args.connections * 2 + 1_000}")
+
+    port = args.port or free_port()
+    # The worker creates the tables on startup
+    worker = start_worker(args, port)
+    try:
+        user_ids = seed_users(args.users)
+        report = asyncio.run(run(args, port, worker, user_ids))
+    finally:
+        worker.terminate()
+        worker.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import APIRouter, FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.api import metrics
 from src.api.v1.routes import api_router
+from src.core.cache import shared_cache
 from src.core.config import Settings, settings
-from src.database.session import init_db
+from src.core.events import event_hub
+from src.core.middleware import QueryMetricsMiddleware
+from src.core.security import hashing_executor
+from src.crud.friends import load_friend_graph, refresh_suggestions
+from src.crud.stats import reconcile_friendship_stats
+from src.database.session import async_replicas, init_db, replicas, run_in_session
 import logging
 
 logging.basicConfig(
@@ -27,6 +36,7 @@ class App:
             redoc_url="/redoc",
             openapi_url="/openapi.json",
             lifespan=self.lifespan,
+            default_response_class=ORJSONResponse,
         )
         self.__setup_middlewares(settings=settings)
         self.__setup_api_routes(settings=settings, router=api_router)
@@ -39,16 +49,78 @@ class App:
             allow_methods=["*"],
             allow_headers=["*"],
         )
+        self.__app.add_middleware(QueryMetricsMiddleware)
 
     def __setup_api_routes(self, router: APIRouter, settings: Settings):
         self.__app.include_router(router, prefix=settings.API_V1_STR)
+        if settings.METRICS_ENABLED:
+            self.__app.include_router(metrics.router)
+
+    async def __refresh_friend_graph(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_in_session(load_friend_graph)
+            except Exception:
+                logger.exception("Failed to refresh the friend graph")
+
+    async def __refresh_suggestions(self, interval: int):
+        # The first build runs right away, requests get no suggestions until it is done
+        while True:
+            try:
+                await run_in_session(refresh_suggestions)
+            except Exception:
+                logger.exception("Failed to rebuild the friend suggestions")
+            await asyncio.sleep(max(interval, 1))
+
+    async def __reconcile_friendship_stats(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                repaired = await run_in_session(reconcile_friendship_stats)
+                if repaired:
+                    logger.warning("Repaired the friendship counters of %d users", repaired)
+            except Exception:
+                logger.exception("Failed to reconcile the friendship counters")
+
+    async def __check_replicas(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            for replica_set in (replicas, async_replicas):
+                await replica_set.check()
 
     @asynccontextmanager
     async def lifespan(self, app: FastAPI):
-        logger.info("Calling init DB...")
-        init_db()
+        logger.info("Checking database schema...")
+        await init_db()
+        hashing_executor.start()
+
+        event_hub.start(asyncio.get_running_loop())
+        background_tasks = [asyncio.create_task(event_hub.heartbeat(settings.EVENTS_HEARTBEAT_SECONDS))]
+        if settings.FRIEND_GRAPH_ENABLED:
+            logger.info("Building friend graph...")
+            await run_in_session(load_friend_graph)
+            background_tasks.append(asyncio.create_task(
+                self.__refresh_friend_graph(settings.FRIEND_GRAPH_REFRESH_SECONDS)))
+        background_tasks.append(asyncio.create_task(
+            self.__refresh_suggestions(settings.SUGGESTIONS_REFRESH_SECONDS)))
+
+        if settings.FRIENDSHIP_STATS_RECONCILE_SECONDS:
+            background_tasks.append(asyncio.create_task(
+                self.__reconcile_friendship_stats(settings.FRIENDSHIP_STATS_RECONCILE_SECONDS)))
+
+        if settings.DATABASE_REPLICA_URLS:
+            background_tasks.append(asyncio.create_task(
+                self.__check_replicas(settings.DATABASE_REPLICA_CHECK_SECONDS)))
+
         yield
 
+        for task in background_tasks:
+            task.cancel()
+        event_hub.stop()
+        hashing_executor.shutdown()
+        shared_cache.close()
+
     def __call__(self):
         return self.__app
 
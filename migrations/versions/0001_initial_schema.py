@@ -0,0 +1,65 @@
+"""initial schema
+
+The users and friendships tables as init_db used to create them.
+Databases created that way are already at this revision: `alembic stamp 0001` and then `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("firstname", sa.String(), nullable=False),
+        sa.Column("lastname", sa.String(), nullable=False),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("password", sa.String(), nullable=False),
+        sa.Column("role", sa.Enum("ADMIN", "MODERATOR", "USER", name="role_enum"), nullable=True),
+        sa.Column("state", sa.Enum("ACTIVE", "INACTIVE", "DELETED", name="state_enum"), nullable=True),
+        sa.Column("type", sa.Enum("PUBLIC", "PRIVATE", name="type_enum"), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("id"),
+        sa.UniqueConstraint("username"),
+        sa.UniqueConstraint("email"),
+    )
+    op.create_table(
+        "friendships",
+        sa.Column("id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=False),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("receiver_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("status", sa.Enum("PENDING", "SEEN", "ACCEPTED", "REJECTED", name="friendship_status_enum"),
+                  nullable=True),
+        sa.Column("responded", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.ForeignKeyConstraint(["receiver_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("id"),
+        sa.UniqueConstraint("user_id", "receiver_id", name="unique_friendship"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("friendships")
+    op.drop_table("users")
+    sa.Enum(name="friendship_status_enum").drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name="type_enum").drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name="state_enum").drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name="role_enum").drop(op.get_bind(), checkfirst=True)
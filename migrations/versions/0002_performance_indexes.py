@@ -0,0 +1,87 @@
+"""performance indexes and canonical friendship pairs
+
+Keyset pagination indexes, pg_trgm search indexes, indexes for the hot user and friendship predicates,
+and the canonical (pair_low_id, pair_high_id) key of friendships, backfilled from user_id / receiver_id.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    is_postgresql = op.get_bind().dialect.name == "postgresql"
+
+    op.create_index("ix_users_username_id", "users", ["username", "id"])
+    op.create_index("ix_users_state_username_id", "users", ["state", "username", "id"])
+    op.create_index("ix_users_role", "users", ["role"])
+
+    if is_postgresql:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.create_index("ix_users_username_trgm", "users", ["username"],
+                        postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"})
+        op.create_index("ix_users_email_trgm", "users", ["email"],
+                        postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"})
+
+    op.add_column("friendships", sa.Column("pair_low_id", postgresql.UUID(as_uuid=True), nullable=True))
+    op.add_column("friendships", sa.Column("pair_high_id", postgresql.UUID(as_uuid=True), nullable=True))
+
+    least, greatest = ("LEAST", "GREATEST") if is_postgresql else ("MIN", "MAX")
+    op.execute(f"UPDATE friendships SET pair_low_id = {least}(user_id, receiver_id), "
+               f"pair_high_id = {greatest}(user_id, receiver_id)")
+
+    # Requests sent in both directions collapse into one pair: keep the accepted one, otherwise the oldest
+    op.execute("""
+        DELETE FROM friendships WHERE id IN (
+            SELECT f.id FROM friendships f
+            JOIN friendships g ON g.pair_low_id = f.pair_low_id AND g.pair_high_id = f.pair_high_id AND g.id <> f.id
+            WHERE (g.status = 'ACCEPTED' AND f.status <> 'ACCEPTED')
+               OR ((g.status = 'ACCEPTED') = (f.status = 'ACCEPTED')
+                   AND (g.created < f.created OR (g.created = f.created AND g.id < f.id)))
+        )
+    """)
+
+    with op.batch_alter_table("friendships") as batch_op:
+        batch_op.alter_column("pair_low_id", nullable=False)
+        batch_op.alter_column("pair_high_id", nullable=False)
+        batch_op.drop_constraint("unique_friendship", type_="unique")
+        batch_op.create_unique_constraint("unique_friendship_pair", ["pair_low_id", "pair_high_id"])
+
+    op.create_index("ix_friendships_created_id", "friendships", ["created", "id"])
+    op.create_index("ix_friendships_status", "friendships", ["status"])
+    op.create_index("ix_friendships_user_id_status", "friendships", ["user_id", "status"])
+    op.create_index("ix_friendships_receiver_id_status", "friendships", ["receiver_id", "status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_friendships_receiver_id_status", table_name="friendships")
+    op.drop_index("ix_friendships_user_id_status", table_name="friendships")
+    op.drop_index("ix_friendships_status", table_name="friendships")
+    op.drop_index("ix_friendships_created_id", table_name="friendships")
+
+    with op.batch_alter_table("friendships") as batch_op:
+        batch_op.drop_constraint("unique_friendship_pair", type_="unique")
+        batch_op.create_unique_constraint("unique_friendship", ["user_id", "receiver_id"])
+        batch_op.drop_column("pair_high_id")
+        batch_op.drop_column("pair_low_id")
+
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_index("ix_users_email_trgm", table_name="users")
+        op.drop_index("ix_users_username_trgm", table_name="users")
+
+    op.drop_index("ix_users_role", table_name="users")
+    op.drop_index("ix_users_state_username_id", table_name="users")
+    op.drop_index("ix_users_username_id", table_name="users")
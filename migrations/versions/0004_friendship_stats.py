@@ -0,0 +1,55 @@
+"""friendship stats
+
+Per-user friend, incoming and outgoing pending request counters, backfilled from friendships.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 23:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "friendship_stats",
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("friends", sa.Integer(), nullable=False),
+        sa.Column("incoming_pending", sa.Integer(), nullable=False),
+        sa.Column("outgoing_pending", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+
+    op.execute("""
+        INSERT INTO friendship_stats (user_id, friends, incoming_pending, outgoing_pending)
+        SELECT user_id, SUM(friends), SUM(incoming_pending), SUM(outgoing_pending) FROM (
+            SELECT user_id,
+                   CASE WHEN status = 'ACCEPTED' THEN 1 ELSE 0 END AS friends,
+                   0 AS incoming_pending,
+                   CASE WHEN status = 'PENDING' THEN 1 ELSE 0 END AS outgoing_pending
+            FROM friendships WHERE status IN ('ACCEPTED', 'PENDING')
+            UNION ALL
+            SELECT receiver_id,
+                   CASE WHEN status = 'ACCEPTED' THEN 1 ELSE 0 END,
+                   CASE WHEN status = 'PENDING' THEN 1 ELSE 0 END,
+                   0
+            FROM friendships WHERE status IN ('ACCEPTED', 'PENDING')
+        ) counts
+        GROUP BY user_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("friendship_stats")
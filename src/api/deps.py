@@ -1,9 +1,10 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
-from src.database.session import SessionLocal
+from src.core.config import settings
+from src.database.session import AsyncSessionLocal, SessionLocal
 
 
-def get_db() -> Generator:
+def get_sync_db() -> Generator:
     """
     Get a database connection from the connection pool and return it to the pool when the request is finished.
     """
@@ -12,3 +13,15 @@ def get_db() -> Generator:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator:
+    """
+    Get an async database session from the async engine pool and close it when the request is finished.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# DATABASE_ASYNC selects which session the endpoints receive; CRUD functions run against either through run_db.
+get_db = get_async_db if settings.DATABASE_ASYNC else get_sync_db
@@ -1,15 +1,29 @@
-from src.core.authentication import get_current_user
+from src.core.authentication import get_current_principal
+from src.schemas.token import Principal
 from src.models.friends import Friendship, FriendshipStatus, FriendRequestAction
-from src.schemas.friends import FriendRequestResponse
+from src.schemas.friends import (FriendRequestResponse, FriendSuggestion, BulkFriendRequestUpdate,
+                                 BulkFriendRequestResult, FriendshipStatsResponse)
+from src.schemas.page import Page
+from src.schemas.user import UserResponse
 from src.models.user import User, Role
 from src.crud.friends import (create_friend_request, view_friend_requests,
-                              view_friends, open_friend_request, get_friendships_log)
-from fastapi import APIRouter, Depends, Header, Query
+                              view_friends, open_friend_request, respond_friend_requests, get_friendships_log,
+                              suggest_friends)
+from src.core.cache import run_cache
+from src.core.events import event_hub
+from src.core.versions import friend_requests_etag, friends_etag, if_none_match
+from src.crud.export import export_friendships
+from src.crud.stats import view_friendship_stats
+from src.models.export import ExportFormat
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import EmailStr
 from sqlalchemy.orm import Session
 from src.api.deps import get_db
-from src.common.responses import BadRequest
-from typing import Optional
+from src.database.session import run_db
+from src.common.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from src.common.responses import BadRequest, NotModified, ServiceUnavailable, Unauthorized
+from typing import List, Optional
 import uuid
 import logging
 
@@ -17,43 +31,120 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.get("/log")
-def get_friendships(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+
+async def conditional(request: Request, etag: Optional[str], db: Session, fn, *args):
+    """
+    Answer with 304 when the client has the current version without running the CRUD function, else tag its response.
+    The ETag is taken before the function runs, so a write racing with it can only make the next poll a 200.
+    """
+    if etag and if_none_match(request, etag):
+        return NotModified(etag)
+
+    response = await run_db(db, fn, *args)
+    if etag and response.status_code == 200:
+        response.headers["ETag"] = etag
+    return response
+
+
+@router.get("/log", response_model=Page[FriendRequestResponse])
+async def get_friendships(cursor: Optional[str] = Query(None, title="Cursor", description="Cursor of the page to get"),
+                          limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, title="Limit",
+                                             description="Maximum number of friendships per page"),
+                          current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    """
+    Get a page of the friendships log.
     """
-    Get a log of friendships.
+    return await run_db(db, get_friendships_log, current_user, cursor, limit)
+
+@router.get("/log/export")
+async def export_friendships_log(file_format: ExportFormat = Query(ExportFormat.NDJSON, alias="format", title="Format",
+                                                                   description="File format of the export"),
+                                 compress: bool = Query(False, title="Compress", description="Gzip the export"),
+                                 current_user: Principal = Depends(get_current_principal)):
+    """
+    Stream the friendships log as NDJSON or CSV.
     """
-    return get_friendships_log(db, current_user)
+    return export_friendships(current_user, file_format, compress)
 
-@router.get("/")
-def get_friends(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.get("/", response_model=List[UserResponse])
+async def get_friends(request: Request, current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
-    Get a list of friends.
+    Get a list of friends. Answers If-None-Match with 304 while it is unchanged.
     """
-    return view_friends(db, current_user)
+    return await conditional(request, current_user and await run_cache(friends_etag, current_user.id),
+                             db, view_friends, current_user)
 
 
-@router.get("/requests")
-def get_friend_requests(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.get("/suggestions", response_model=List[FriendSuggestion])
+async def get_friend_suggestions(limit: int = Query(20, ge=1, le=100, title="Limit",
+                                                    description="Maximum number of suggestions"),
+                                 current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
-    Get a list of friend requests.
+    Get people you may know, ranked by mutual friends. Served from the current matrix, which the app rebuilds
+    in the background.
     """
-    return view_friend_requests(db, current_user)
+    return await run_db(db, suggest_friends, current_user, limit)
 
 
-@router.post("/requests")
-def send_friend_request(receiver_id: uuid.UUID, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.get("/requests", response_model=List[FriendRequestResponse])
+async def get_friend_requests(request: Request, current_user: Principal = Depends(get_current_principal),
+                              db: Session = Depends(get_db)):
+    """
+    Get a list of friend requests. Answers If-None-Match with 304 while it is unchanged.
+    """
+    return await conditional(request, current_user and await run_cache(friend_requests_etag, current_user.id),
+                             db, view_friend_requests, current_user)
+
+
+@router.get("/stats", response_model=FriendshipStatsResponse)
+async def get_friendship_stats(current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    """
+    Get the number of friends and of pending friend requests received and sent, without loading the lists.
+    """
+    return await run_db(db, view_friendship_stats, current_user)
+
+
+@router.get("/events")
+async def get_friend_request_events(current_user: Principal = Depends(get_current_principal)):
+    """
+    Stream friend request events as server-sent events, instead of polling GET /friends/requests.
+    The receiver of a request gets friend_request.created, both users get friend_request.accepted,
+    friend_request.rejected and friend_request.seen, each with the friend request as data.
+    """
+    if not current_user:
+        return Unauthorized()
+
+    if event_hub.full:
+        return ServiceUnavailable("Too many open event streams, try again later")
+
+    return StreamingResponse(event_hub.stream(current_user.id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/requests", response_model=FriendRequestResponse)
+async def send_friend_request(receiver_id: uuid.UUID, current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     Send a friend request.
     """
-    return create_friend_request(db, current_user, receiver_id)
+    return await run_db(db, create_friend_request, current_user, receiver_id)
+
+
+@router.put("/requests", response_model=List[BulkFriendRequestResult])
+async def respond_friend_requests_in_bulk(update: BulkFriendRequestUpdate,
+                                          current_user: Principal = Depends(get_current_principal),
+                                          db: Session = Depends(get_db)):
+    """
+    Accept or reject up to 500 friend requests at once, with a result per request.
+    """
+    return await run_db(db, respond_friend_requests, current_user, update.ids, update.action)
 
 
-@router.put("/requests/{friend_request_id}")
-def respond_friend_request(friend_request_id: uuid.UUID,
-                          action: Optional[FriendRequestAction] = Query(None, title="Action",
-                                                                        description="Action to take on the friend request"),
-                          current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@router.put("/requests/{friend_request_id}", response_model=FriendRequestResponse)
+async def respond_friend_request(friend_request_id: uuid.UUID,
+                                action: Optional[FriendRequestAction] = Query(None, title="Action",
+                                                                              description="Action to take on the friend request"),
+                                current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     Respond to a friend request.
     """
-    return open_friend_request(db, current_user, friend_request_id, action)
+    return await run_db(db, open_friend_request, current_user, friend_request_id, action)
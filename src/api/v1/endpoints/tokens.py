@@ -1,15 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Form, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from src.schemas.token import Token
 from sqlalchemy.orm import Session
 from src.api.deps import get_db
 from src.core.authentication import authenticate_user, create_access_token
+from src.core.config import settings
+from src.core.rate_limit import limit_login, login_failed
+from src.core.security import HashingPoolSaturated
+from src.crud.token import issue_refresh_token, rotate_refresh_token
+from src.database.session import run_db
 
 router = APIRouter()
 
 
-@router.post("/")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_db)):
+@router.post("/", response_model=Token, dependencies=[Depends(limit_login)])
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_db)):
     """
     Authenticate the user and return an access token.
 
@@ -18,12 +23,21 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), ses
         session (Session): The SQLAlchemy session object.
 
     Returns:
-        Token: An access token if authentication is successful, or an HTTPException if authentication fails.
+        Token: An access token and a refresh token if authentication is successful, or an HTTPException
+        if authentication fails, or with 429 if the client or the username made too many attempts.
     """
 
-    user = authenticate_user(form_data.username, form_data.password, session)
+    try:
+        user = await authenticate_user(form_data.username, form_data.password, session)
+    except HashingPoolSaturated:
+        raise HTTPException(
+            status_code=503,
+            detail="The service is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
 
     if not user:
+        await login_failed(form_data.username)
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
@@ -31,4 +45,27 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), ses
         )
 
     access_token = create_access_token(user=user)
-    return Token(access_token=access_token, token_type="bearer")
+    refresh_token = await run_db(session, issue_refresh_token, user.id)
+    return Token(access_token=access_token, token_type="bearer", expires_in=settings.JWT_EXPIRATION * 60,
+                 refresh_token=refresh_token)
+
+
+@router.post("/refresh", response_model=Token)
+async def refresh_access_token(refresh_token: str = Form(..., title="Refresh token",
+                                                         description="Refresh token from the last token response"),
+                               session: Session = Depends(get_db)):
+    """
+    Exchange a refresh token for a new access token, with fresh claims, and a new refresh token.
+    A refresh token works once; using it again revokes every token rotated from the same login.
+    """
+    rotated = await run_db(session, rotate_refresh_token, refresh_token)
+    if rotated is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    user, new_refresh_token = rotated
+    return Token(access_token=create_access_token(user=user), token_type="bearer",
+                 expires_in=settings.JWT_EXPIRATION * 60, refresh_token=new_refresh_token)
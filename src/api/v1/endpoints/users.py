@@ -1,21 +1,31 @@
 import uuid
 
-from fastapi import APIRouter, Depends, Header, Query
+from fastapi import APIRouter, Depends, Header, Query, Request, Response
 from pydantic import EmailStr
 from sqlalchemy.orm import Session
 from src.api.deps import get_db
-from src.common.responses import BadRequest
-from typing import Optional
+from src.database.session import run_db
+from src.common.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from src.common.responses import BadRequest, NotModified
+from typing import List, Optional
 import logging
 
-from src.core.authentication import get_current_user
+from src.core.authentication import get_current_principal, get_current_user, oauth2_scheme, token_user_identifier
+from src.schemas.token import Principal
+from src.core.cache import run_cache
+from src.core.rate_limit import limit_registration
+from src.core.versions import if_none_match, profile_etag
 
 from src.models.user import User, Role, StateAction, ProfileType
 from src.models.search import SearchType
+from src.models.export import ExportFormat
+from src.schemas.page import Page
 from src.schemas.user import (CreateUserRequest, LoginRequest,
-                              UpdateEmailRequest)
+                              UpdateEmailRequest, UserResponse, BulkImportResponse, UserBatchItem)
 
-from src.crud.user import create_user, get_me, search_user, change_state, change_type
+from src.crud.user import (create_user, get_me, search_user, get_users_by_ids, change_state, change_type,
+                           import_users)
+from src.crud.export import export_users
 
 
 logger = logging.getLogger(__name__)
@@ -23,44 +33,99 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-@router.get("/me")
-def me(user: User = Depends(get_current_user)):
+@router.get("/me", response_model=UserResponse)
+async def me(request: Request, response: Response, token: Optional[str] = Depends(oauth2_scheme),
+             db: Session = Depends(get_db)):
+    """
+    Get your profile. Answers If-None-Match with 304 while it is unchanged.
+    The ETag is taken before the profile is resolved, so a change racing with it can only make the next poll a 200.
+    """
+    user_id = token_user_identifier(token)
+    etag = user_id and await run_cache(profile_etag, user_id)
+    if etag and if_none_match(request, etag):
+        return NotModified(etag)
+
+    user = await get_current_user(token, db)
+    if user and etag:
+        response.headers["ETag"] = etag
+
     return get_me(user)
 
-@router.get("/")
-def get_users(search_type: Optional[SearchType] = Query(None, title="Search type", description="Type of search"),
-              search_query: Optional[str] = Query(None, title="Search query", description="Query to search for"),
-              current_user: User = Depends(get_current_user),
-              db: Session = Depends(get_db)):
+@router.get("/", response_model=Page[UserResponse])
+async def get_users(search_type: Optional[SearchType] = Query(None, title="Search type", description="Type of search"),
+                    search_query: Optional[str] = Query(None, title="Search query", description="Query to search for"),
+                    cursor: Optional[str] = Query(None, title="Cursor", description="Cursor of the page to get"),
+                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, title="Limit",
+                                       description="Maximum number of users per page"),
+                    current_user: Principal = Depends(get_current_principal),
+                    db: Session = Depends(get_db)):
     """
-    Get a list of users.
+    Get a page of users.
     """
-    return search_user(db, current_user, search_type , search_query)
+    return await run_db(db, search_user, current_user, search_type, search_query, cursor, limit)
+
+
+@router.get("/batch", response_model=List[UserBatchItem])
+async def get_users_batch(ids: List[str] = Query(..., title="IDs",
+                                                 description="User ids, comma separated or as repeated parameters"),
+                          current_user: Principal = Depends(get_current_principal),
+                          db: Session = Depends(get_db)):
+    """
+    Get many users by id at once, in the order given. Unknown or hidden users come back as null.
+    """
+    try:
+        user_ids = [uuid.UUID(user_id) for value in ids for user_id in value.split(",") if user_id.strip()]
+    except ValueError:
+        return BadRequest("Invalid user id.")
+
+    return await run_db(db, get_users_by_ids, current_user, user_ids)
 
 
-@router.put("/type")
-def change_user_type(current_user: User = Depends(get_current_user),
-                     action: ProfileType = Query(..., title="Action", description="Action to perform"),
-                     db: Session = Depends(get_db)):
+@router.get("/export")
+async def export_user_directory(file_format: ExportFormat = Query(ExportFormat.NDJSON, alias="format", title="Format",
+                                                                  description="File format of the export"),
+                                compress: bool = Query(False, title="Compress", description="Gzip the export"),
+                                current_user: Principal = Depends(get_current_principal)):
+    """
+    Stream the users directory as NDJSON or CSV.
+    """
+    return export_users(current_user, file_format, compress)
+
+
+@router.put("/type", response_model=UserResponse)
+async def change_user_type(current_user: Principal = Depends(get_current_principal),
+                           action: ProfileType = Query(..., title="Action", description="Action to perform"),
+                           db: Session = Depends(get_db)):
     """
     Change your profile type.
     """
-    return change_type(db, current_user, action)
+    return await run_db(db, change_type, current_user, action)
 
 
-@router.put("/state")
-def change_user_state(current_user: User = Depends(get_current_user),
-                      user_id: uuid.UUID = Query(..., title="User ID", description="ID of the user to change state"),
-                      action: StateAction = Query(..., title="Action", description="Action to perform"),
-                      db: Session = Depends(get_db)):
+@router.put("/state", response_model=UserResponse)
+async def change_user_state(current_user: Principal = Depends(get_current_principal),
+                            user_id: uuid.UUID = Query(..., title="User ID", description="ID of the user to change state"),
+                            action: StateAction = Query(..., title="Action", description="Action to perform"),
+                            db: Session = Depends(get_db)):
     """
     Change the state of a user.
     """
-    return change_state(db, current_user, user_id, action)
+    return await run_db(db, change_state, current_user, user_id, action)
 
-@router.post("/")
-def register(current_user: CreateUserRequest, db: Session = Depends(get_db)):
+@router.post("/", response_model=UserResponse, dependencies=[Depends(limit_registration)])
+async def register(current_user: CreateUserRequest, db: Session = Depends(get_db)):
     """
     Register a new user.
     """
-    return create_user(db, current_user)
+    return await create_user(db, current_user)
+
+
+@router.post("/bulk", response_model=BulkImportResponse)
+async def bulk_register(request: Request, current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    """
+    Register users in bulk from an NDJSON (default) or CSV (Content-Type: text/csv) request body. Admin only.
+    CSV needs a header row with firstname, lastname, username, email and password. The body must be UTF-8,
+    rejected rows are reported by line number.
+    """
+    file_format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+    return await import_users(db, current_user, request.stream(), file_format)
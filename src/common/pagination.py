@@ -0,0 +1,70 @@
+import base64
+import binascii
+import json
+import uuid
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, tuple_
+from sqlalchemy.orm import Query
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Encode the keyset values of the last row of a page into an opaque cursor.
+    """
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> List[Any]:
+    """
+    Decode a cursor back into keyset values of the given python types.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+
+    # encode_cursor writes every value as a string
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(isinstance(value, str) for value in values)):
+        raise ValueError("Invalid cursor")
+
+    try:
+        return [_coerce(python_type, value) for python_type, value in zip(types, values)]
+    except TypeError:
+        raise ValueError("Invalid cursor")
+
+
+def _coerce(python_type: type, value: Any) -> Any:
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is uuid.UUID:
+        return uuid.UUID(value)
+    return python_type(value)
+
+
+def paginate(query: Query, columns: Sequence[Column], cursor: Optional[str], limit: int) -> Tuple[list, Optional[str]]:
+    """
+    Apply keyset pagination to a query ordered by the given columns.
+    Only the rows after the cursor are fetched, so the cost of a page does not depend on how deep it is.
+    Returns the rows of the page and the cursor of the next page, or None on the last page.
+    Raises ValueError if the cursor is malformed.
+    """
+    if cursor:
+        query = query.filter(tuple_(*columns) > tuple(decode_cursor(cursor, [column.type.python_type for column in columns])))
+
+    rows = query.order_by(*columns).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+
+    return rows, next_cursor
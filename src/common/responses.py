@@ -69,3 +69,20 @@ class NoContent(Response):
 class InternalServerError(JSONResponse):
     def __init__(self, content="An unexpected error occurred"):
         super().__init__(status_code=500, content={"detail": content})
+
+
+class ServiceUnavailable(JSONResponse):
+    def __init__(self, content="The service is busy, try again later"):
+        super().__init__(status_code=503, content={"detail": content})
+
+
+class JSONBytes(Response):
+    """
+    A body that is already encoded JSON, sent as is.
+    """
+    media_type = "application/json"
+
+
+class NotModified(Response):
+    def __init__(self, etag: str):
+        super().__init__(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,52 @@
+import codecs
+import io
+import tempfile
+from typing import AsyncIterable, TextIO
+
+# Uploads up to this size stay in memory, larger ones go to a temporary file
+SPOOL_MEMORY_BYTES = 1 << 20
+
+
+class InvalidEncoding(ValueError):
+    """
+    Raised by spool_text when a stream doesn't decode, with the offset of its first invalid byte.
+    """
+
+    def __init__(self, encoding: str, offset: int):
+        super().__init__(f"Not valid {encoding}, the first invalid byte is at offset {offset}")
+        self.offset = offset
+
+
+async def spool_text(chunks: AsyncIterable[bytes], encoding: str = "utf-8") -> TextIO:
+    """
+    Copy a stream of byte chunks, e.g. a request body, to a temporary file without holding it all in memory,
+    and return it as text from the start. The whole stream is checked to decode before anything reads it.
+    Lines keep their endings (newline=""), so csv.reader reads quoted fields that span lines.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+
+    try:
+        async for chunk in chunks:
+            pending = len(decoder.getstate()[0])
+            try:
+                decoder.decode(chunk)
+            except UnicodeDecodeError as error:
+                # The decoder counts from the bytes it held back from the previous chunk
+                raise InvalidEncoding(encoding, size - pending + error.start) from None
+            spooled.write(chunk)
+            size += len(chunk)
+
+        pending = len(decoder.getstate()[0])
+        try:
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            # A truncated character at the end
+            raise InvalidEncoding(encoding, size - pending) from None
+    except BaseException:
+        spooled.close()
+        raise
+
+    spooled.seek(0)
+    return io.TextIOWrapper(spooled, encoding=encoding, newline="")
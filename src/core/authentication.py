@@ -1,14 +1,20 @@
 import os
+import uuid
 from datetime import timedelta, datetime, timezone
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from dotenv import load_dotenv
-from src.schemas.token import TokenData
-from src.models.user import User, State
+from src.schemas.token import Principal, TokenData
+from src.models.user import User, Role, State, ProfileType
 from sqlalchemy.orm import Session
 from src.api.deps import get_db
+from src.core.cache import TTLCache, run_cache, shared_cache
+from src.core.config import settings
+from src.core.metrics import register_cache
+from src.core.security import check_password, pwd_context
+from src.core.versions import profile_versions
+from src.database.session import run_db
 from pydantic import EmailStr
 
 
@@ -16,12 +22,15 @@ load_dotenv()
 
 _SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 _ALGORITHM = os.getenv("JWT_ALGORITHM")
-_ACCESS_TOKEN_EXPIRE = int(os.getenv("JWT_EXPIRATION"))
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/token/", auto_error=False)
 
+# Detached User objects shared between requests, treat them as read-only.
+# Keyed by (user id, profile version) like the cached users, see src/core/versions.py
+principal_cache = TTLCache(maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL)
+register_cache("principal", principal_cache)
+
 
 # utility funcs
 def verify_password(plain_password: str, hash_password: str):
@@ -32,33 +41,87 @@ def get_password_hash(password: str):
     return pwd_context.hash(password)
 
 
-def authenticate_user(
+def get_active_user_by_username(session: Session, username: str) -> User | None:
+    """
+    Load an active user, detached, and give the connection back to the pool: the password check that follows
+    can wait for bcrypt a long time during a burst of logins, and must not hold a connection meanwhile.
+    """
+    user = session.query(User).filter(User.username == username, User.state == State.ACTIVE).first()
+    if user is not None:
+        session.expunge(user)
+    session.rollback()
+    return user
+
+
+def load_principal(session: Session, user_identifier: uuid.UUID) -> User | None:
+    """
+    Load the user behind a token, detached from the session so it can be cached across requests.
+    """
+    user = session.query(User).filter(User.id == user_identifier).first()
+    if user is not None:
+        session.expunge(user)
+    return user
+
+
+def claims_changed_key(user_identifier: uuid.UUID) -> str:
+    return f"claims_changed:{user_identifier}"
+
+
+def revoke_claims(user_identifier: uuid.UUID):
+    """
+    Stop trusting the claims of the access tokens a user already has, in every worker, those started later included.
+    Must be called after every committed change to the role, state or profile type of a user.
+    The time of the change is a stamp in the shared cache, kept as long as the access tokens issued before can live.
+    """
+    shared_cache.stamp(claims_changed_key(user_identifier), ttl=settings.JWT_EXPIRATION * 60 + 60)
+
+
+async def authenticate_user(
     username: str, password: str, session: Session = Depends(get_db)
 ) -> User | None:
 
-    user = session.query(User).filter(User.username == username, User.state == State.ACTIVE).first()
+    user = await run_db(session, get_active_user_by_username, username)
 
     if user is None:
         return None
 
     hash_password = user.password
-    if not verify_password(password, hash_password):
+    if not await check_password(password, hash_password):
         return None
 
     return user
 
 
 def create_access_token(user: User) -> str:
-    to_encode = {"user_id": str(user.id)}
-
-    expire = datetime.now(timezone.utc) + timedelta(minutes=_ACCESS_TOKEN_EXPIRE)
+    """
+    Issue an access token for JWT_EXPIRATION minutes, with the claims get_current_principal authorizes from.
+    """
+    now = datetime.now(timezone.utc)
+    to_encode = {"user_id": str(user.id), "typ": "access", "role": user.role.value, "state": user.state.value,
+                 "type": user.type.value, "iat": now}
+
+    expire = now + timedelta(minutes=settings.JWT_EXPIRATION)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, _SECRET_KEY, algorithm=_ALGORITHM)
 
     return encoded_jwt
 
 
-def get_current_user(
+def token_user_identifier(token: str | None) -> uuid.UUID | None:
+    """
+    The user id of a valid token, without loading the user, e.g. to tag a response before resolving the profile.
+    """
+    if token is None:
+        return None
+
+    try:
+        payload = jwt.decode(token, _SECRET_KEY, algorithms=[_ALGORITHM])
+        return TokenData(user_identifier=payload.get("user_id")).user_identifier
+    except (JWTError, ValueError):
+        return None
+
+
+async def get_current_user(
     token: str = Depends(oauth2_scheme), session: Session = Depends(get_db)
 ) -> User | None:
     credential_exception = HTTPException(
@@ -75,11 +138,49 @@ def get_current_user(
         if user_identifier is None:
             raise credential_exception
 
-        TokenData(user_identifier=user_identifier)
+        token_data = TokenData(user_identifier=user_identifier)
 
     except JWTError:
         return None
 
-    user = session.query(User).filter(User.id == user_identifier).first()
+    # Taken before the load: a principal read before a change committed is cached under a retired version
+    version, = await run_cache(profile_versions, [token_data.user_identifier])
+    cache_key = (token_data.user_identifier, version)
+    user = principal_cache.get(cache_key)
+    if user is None:
+        user = await run_db(session, load_principal, token_data.user_identifier)
+        if user is not None:
+            principal_cache.set(cache_key, user)
+
+    return user
+
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme), session: Session = Depends(get_db)
+) -> Principal | User | None:
+    """
+    Authorize from the claims of the access token, without touching the database.
+    Falls back to get_current_user for tokens issued before the user's role, state or profile type changed,
+    and for tokens without claims. Endpoints that need the rest of the profile use get_current_user.
+    """
+    if token is None:
+        return None
+
+    try:
+        payload = jwt.decode(token, _SECRET_KEY, algorithms=[_ALGORITHM])
+    except JWTError:
+        return None
+
+    if payload.get("typ") != "access" or "role" not in payload:
+        return await get_current_user(token, session)
+
+    try:
+        principal = Principal(id=payload["user_id"], role=Role(payload["role"]), state=State(payload["state"]),
+                              type=ProfileType(payload["type"]))
+    except (KeyError, ValueError):
+        return None
+
+    changed, = await run_cache(shared_cache.stamps, [claims_changed_key(principal.id)])
+    if changed is not None and payload.get("iat", 0) <= changed:
+        return await get_current_user(token, session)
 
-    return user
\ No newline at end of file
+    return principal
@@ -0,0 +1,382 @@
+import functools
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy.util import await_only
+from sqlalchemy.util.concurrency import in_greenlet
+from starlette.concurrency import run_in_threadpool
+
+from src.core.config import settings
+from src.core.metrics import register_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Thread-safe bounded LRU cache whose entries also expire after a fixed time to live.
+    Counts hits, misses, evictions (entries dropped to make room) and expirations.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class CacheBackend:
+    """
+    Cache shared by all the workers of a deployment: byte values with a time to live, counters that are never
+    evicted, and pub/sub messages delivered to every process, e.g. to invalidate the caches each of them keeps.
+    """
+
+    # Whether calls go over the network, callers on the event loop then run them in the threadpool
+    remote = False
+
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        raise NotImplementedError
+
+    def set_many(self, items: Dict[str, bytes], ttl: float):
+        """
+        Store values for `ttl` seconds, a ttl of 0 stores nothing.
+        """
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+    def incr(self, *keys: str):
+        raise NotImplementedError
+
+    def counters(self, keys: List[str]) -> Tuple[str, List[int]]:
+        """
+        Read counters, with the epoch of the store: it changes whenever the counters may have started over.
+        """
+        raise NotImplementedError
+
+    def stamp(self, key: str, ttl: float):
+        """
+        Record the current time under `key` for `ttl` seconds. Unlike values, stamps are never evicted
+        to make room before they expire, so they can carry revocations.
+        """
+        raise NotImplementedError
+
+    def stamps(self, keys: List[str]) -> List[Optional[float]]:
+        raise NotImplementedError
+
+    def take(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        """
+        Take `cost` tokens from the token bucket `key`, which holds up to `burst` tokens and refills `rate` per second.
+        Returns 0 when they were taken, else the seconds until they will be there; a cost of 0 only checks
+        that a token is left.
+        """
+        raise NotImplementedError
+
+    def publish(self, topic: str, message: str):
+        """
+        Deliver a message to the subscribers of `topic` in every process, this one included.
+        """
+        raise NotImplementedError
+
+    def subscribe(self, topic: str, callback: Callable[[str], None]):
+        self._listeners.setdefault(topic, []).append(callback)
+
+    def _dispatch(self, topic: str, message: str):
+        for callback in self._listeners.get(topic, ()):
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("Subscriber of %s failed on %r", topic, message)
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Process-local backend, for a single worker or for development.
+    """
+
+    def __init__(self, maxsize: int):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.values = TTLCache(maxsize=maxsize, ttl=0)
+        self._buckets = TTLCache(maxsize=maxsize, ttl=0)
+        self._counters: Dict[str, int] = {}
+        # key: (expires, time), expired stamps are swept when the dict has doubled since the last sweep
+        self._stamps: Dict[str, Tuple[float, float]] = {}
+        self._next_sweep = 1024
+        self._lock = threading.Lock()
+        self._listeners: Dict[str, List[Callable[[str], None]]] = {}
+
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return [self.values.get(key) for key in keys]
+
+    def set_many(self, items: Dict[str, bytes], ttl: float):
+        if ttl <= 0:
+            return
+        for key, value in items.items():
+            self.values.set(key, value, ttl=ttl)
+
+    def delete(self, *keys: str):
+        for key in keys:
+            self.values.delete(key)
+
+    def incr(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._counters[key] = self._counters.get(key, 0) + 1
+
+    def counters(self, keys: List[str]) -> Tuple[str, List[int]]:
+        return self.epoch, [self._counters.get(key, 0) for key in keys]
+
+    def stamp(self, key: str, ttl: float):
+        with self._lock:
+            now = time.monotonic()
+            self._stamps[key] = (now + ttl, time.time())
+            if len(self._stamps) >= self._next_sweep:
+                self._stamps = {stamp_key: stamp for stamp_key, stamp in self._stamps.items() if stamp[0] > now}
+                self._next_sweep = max(1024, 2 * len(self._stamps))
+
+    def stamps(self, keys: List[str]) -> List[Optional[float]]:
+        now = time.monotonic()
+        stamps = [self._stamps.get(key) for key in keys]
+        return [stamp[1] if stamp is not None and stamp[0] > now else None for stamp in stamps]
+
+    def take(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            retry_after = 0.0
+            if tokens < max(cost, 1):
+                retry_after = (max(cost, 1) - tokens) / rate
+            else:
+                tokens -= cost
+            # A bucket that has refilled is the same as no bucket
+            self._buckets.set(key, (tokens, now), ttl=(burst - tokens) / rate)
+            return retry_after
+
+    def publish(self, topic: str, message: str):
+        self._dispatch(topic, message)
+
+
+def _off_the_loop(method: Callable) -> Callable:
+    """
+    Run a blocking backend call in the threadpool when it comes from the greenlet of AsyncSession.run_sync,
+    where CRUD code runs on the event loop thread in DATABASE_ASYNC mode. The greenlet waits for the call
+    the way it waits for the async database driver, and the loop serves other requests meanwhile.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if in_greenlet():
+            return await_only(run_in_threadpool(method, *args, **kwargs))
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+class RedisBackend(CacheBackend):
+    """
+    Backend on a Redis-protocol server (Redis, Valkey, KeyDB...), shared by all the workers.
+    Messages go through one pub/sub channel that every process listens to on a background thread, which
+    reconnects and subscribes again after losing the server; messages published meanwhile are lost.
+    Counters are stored without expiry and stamps must not be evicted before they expire: run the server with the
+    noeviction policy, or a volatile-* one with memory to spare.
+    Takes an existing client, e.g. a fakeredis one, instead of the URL.
+    """
+
+    remote = True
+
+    # Seconds between attempts to get the pub/sub connection back
+    RECONNECT_DELAY = 1.0
+
+    # Token bucket of CacheBackend.take, on the server's clock so every worker refills it the same way
+    TAKE_SCRIPT = """
+        local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local time = redis.call("TIME")
+        local now = time[1] + time[2] / 1000000
+        local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+        local tokens = math.min(burst, (tonumber(bucket[1]) or burst) + (now - (tonumber(bucket[2]) or now)) * rate)
+        local retry_after = 0
+        if tokens < math.max(cost, 1) then
+            retry_after = (math.max(cost, 1) - tokens) / rate
+        else
+            tokens = tokens - cost
+        end
+        redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+        redis.call("PEXPIRE", KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+        return tostring(retry_after)
+    """
+
+    def __init__(self, url: str, prefix: str = "atrium:", client=None):
+        if client is None:
+            # Only needed with CACHE_BACKEND=redis
+            import redis
+            client = redis.Redis.from_url(url)
+
+        self._redis = client
+        self._take = client.register_script(self.TAKE_SCRIPT)
+        self._prefix = prefix
+        self._channel = f"{prefix}events"
+        self._listeners: Dict[str, List[Callable[[str], None]]] = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def _keys(self, keys) -> List[str]:
+        return [self._prefix + key for key in keys]
+
+    @_off_the_loop
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return self._redis.mget(self._keys(keys)) if keys else []
+
+    @_off_the_loop
+    def set_many(self, items: Dict[str, bytes], ttl: float):
+        if not items or ttl <= 0:
+            return
+        pipeline = self._redis.pipeline(transaction=False)
+        for key, value in items.items():
+            pipeline.set(self._prefix + key, value, ex=max(1, int(ttl)))
+        pipeline.execute()
+
+    @_off_the_loop
+    def delete(self, *keys: str):
+        if keys:
+            self._redis.delete(*self._keys(keys))
+
+    @_off_the_loop
+    def incr(self, *keys: str):
+        pipeline = self._redis.pipeline(transaction=False)
+        for key in self._keys(keys):
+            pipeline.incr(key)
+        pipeline.execute()
+
+    @_off_the_loop
+    def counters(self, keys: List[str]) -> Tuple[str, List[int]]:
+        epoch, *values = self._redis.mget([self._prefix + "epoch", *self._keys(keys)])
+        if epoch is None:
+            # A new server, or one that lost its data: counters start over under a new epoch
+            self._redis.set(self._prefix + "epoch", uuid.uuid4().hex[:12], nx=True)
+            return self.counters(keys)
+        return epoch.decode(), [int(value) if value is not None else 0 for value in values]
+
+    @_off_the_loop
+    def stamp(self, key: str, ttl: float):
+        self._redis.set(self._prefix + key, repr(time.time()), ex=max(1, int(ttl)))
+
+    @_off_the_loop
+    def stamps(self, keys: List[str]) -> List[Optional[float]]:
+        return [float(value) if value is not None else None
+                for value in (self._redis.mget(self._keys(keys)) if keys else [])]
+
+    @_off_the_loop
+    def take(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        return float(self._take(keys=[self._prefix + key], args=[rate, burst, cost]))
+
+    @_off_the_loop
+    def publish(self, topic: str, message: str):
+        self._redis.publish(self._channel, f"{topic}:{message}")
+
+    def subscribe(self, topic: str, callback: Callable[[str], None]):
+        super().subscribe(topic, callback)
+
+        with self._lock:
+            if self._listener is None:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self._channel: self._on_message})
+                self._listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True,
+                                                      exception_handler=self._on_listener_error)
+
+    def _on_listener_error(self, error: BaseException, pubsub, thread):
+        # Without a handler the error ends the thread and messages stop arriving for good. The next
+        # get_message reconnects, and the pubsub subscribes to the channel again when it does.
+        logger.warning("Lost the pub/sub connection, retrying in %ss: %r", self.RECONNECT_DELAY, error)
+        time.sleep(self.RECONNECT_DELAY)
+
+    def _on_message(self, message):
+        topic, _, data = message["data"].decode().partition(":")
+        self._dispatch(topic, data)
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+        self._redis.close()
+
+
+def create_backend() -> CacheBackend:
+    if settings.CACHE_BACKEND == "redis":
+        return RedisBackend(settings.REDIS_URL)
+    return MemoryBackend(maxsize=settings.CACHE_SIZE)
+
+
+shared_cache = create_backend()
+if isinstance(shared_cache, MemoryBackend):
+    register_cache("shared", shared_cache.values)
+
+
+async def run_cache(fn: Callable, *args) -> Any:
+    """
+    Call a function that uses the shared cache from the event loop, in the threadpool when the cache is remote.
+    """
+    if shared_cache.remote:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
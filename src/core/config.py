@@ -1,11 +1,23 @@
 import os
 from functools import lru_cache
-from typing import List, Union
+from typing import List, Literal, Optional, Union
 
-from pydantic import field_validator
+from pydantic import Field, ValidationInfo, field_validator
 from pydantic_settings import BaseSettings
 
 
+def to_async_url(url: str) -> str:
+    """
+    Swap the driver of a database URL for its asyncio counterpart (asyncpg, aiosqlite).
+    """
+    for sync_driver, async_driver in (("postgresql+psycopg2://", "postgresql+asyncpg://"),
+                                      ("postgresql://", "postgresql+asyncpg://"),
+                                      ("sqlite://", "sqlite+aiosqlite://")):
+        if url.startswith(sync_driver):
+            return async_driver + url[len(sync_driver):]
+    return url
+
+
 class Settings(BaseSettings):
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "App"
@@ -21,10 +33,102 @@ class Settings(BaseSettings):
 
     JWT_SECRET_KEY: str = os.getenv("SECRET_KEY", "secret")
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
+    # Minutes an access token lives. Tokens carry the role, state and profile type: a change made through the API
+    # revokes them at once, one made straight in the database only when they expire. Lower it where every client
+    # renews its tokens with the refresh tokens, rotated on every use; the web client doesn't yet
     JWT_EXPIRATION: int = os.getenv("JWT_EXPIRATION", 60)
+    REFRESH_TOKEN_EXPIRATION_DAYS: int = os.getenv("REFRESH_TOKEN_EXPIRATION_DAYS", 30)
 
     DATABASE_URL: str = os.getenv("DATABASE_URL")
 
+    # Fraction of SQL statements logged with their parameters, 0 logs none and 1 logs all of them
+    SQL_ECHO_SAMPLE_RATE: float = os.getenv("SQL_ECHO_SAMPLE_RATE", 0)
+
+    # Serve Prometheus metrics at GET /metrics
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", True)
+
+    # "verify": only check that the schema is at the latest migration (`alembic upgrade head` creates it),
+    # "create": create missing tables with metadata.create_all, for throwaway SQLite databases
+    DATABASE_STARTUP: Literal["verify", "create"] = os.getenv("DATABASE_STARTUP", "verify")
+
+    # Serve requests from an AsyncEngine (asyncpg / aiosqlite) instead of the blocking engine
+    DATABASE_ASYNC: bool = os.getenv("DATABASE_ASYNC", False)
+    ASYNC_DATABASE_URL: Optional[str] = Field(default=os.getenv("ASYNC_DATABASE_URL"), validate_default=True)
+
+    @field_validator("ASYNC_DATABASE_URL")
+    def assemble_async_database_url(cls, v: Optional[str], info: ValidationInfo) -> Optional[str]:
+        if v or not info.data.get("DATABASE_URL"):
+            return v
+
+        return to_async_url(info.data["DATABASE_URL"])
+
+    # Read replicas for the read-only CRUD functions, comma separated; writes always go to DATABASE_URL
+    DATABASE_REPLICA_URLS: Union[str, List[str]] = os.getenv("DATABASE_REPLICA_URLS", [])
+    # How often replicas are health checked, a replica that failed is skipped until it passes again
+    DATABASE_REPLICA_CHECK_SECONDS: int = os.getenv("DATABASE_REPLICA_CHECK_SECONDS", 10)
+
+    @field_validator("DATABASE_REPLICA_URLS")
+    def split_replica_urls(cls, v: Union[str, List[str]]) -> List[str]:
+        if isinstance(v, str):
+            return [url.strip() for url in v.split(",") if url.strip()]
+        return v
+
+    # Cache shared by the workers: "memory" keeps it in each process, "redis" on the Redis-protocol server at REDIS_URL
+    CACHE_BACKEND: Literal["memory", "redis"] = os.getenv("CACHE_BACKEND", "memory")
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    # Entries kept by the memory backend, and how long users and friend lists stay cached (0 doesn't cache them)
+    CACHE_SIZE: int = os.getenv("CACHE_SIZE", 100000)
+    CACHE_TTL: int = os.getenv("CACHE_TTL", 60)
+
+    # Server-sent event streams (GET /friends/events) a worker holds before answering 503, events a stream may
+    # fall behind by before it is closed, seconds between heartbeats, and the reconnect delay suggested to clients
+    EVENTS_MAX_CONNECTIONS: int = os.getenv("EVENTS_MAX_CONNECTIONS", 50000)
+    EVENTS_QUEUE_SIZE: int = os.getenv("EVENTS_QUEUE_SIZE", 16)
+    EVENTS_HEARTBEAT_SECONDS: int = os.getenv("EVENTS_HEARTBEAT_SECONDS", 15)
+    EVENTS_RETRY_MILLISECONDS: int = os.getenv("EVENTS_RETRY_MILLISECONDS", 3000)
+
+    # Resolved principals kept in process by get_current_user, keyed by user id (size 0 disables the cache)
+    PRINCIPAL_CACHE_SIZE: int = os.getenv("PRINCIPAL_CACHE_SIZE", 10000)
+    PRINCIPAL_CACHE_TTL: int = os.getenv("PRINCIPAL_CACHE_TTL", 30)
+
+    # Token buckets that turn away logins and registrations before they reach the database or bcrypt: attempts a
+    # minute and burst per client IP, and failed logins per username. RATE_LIMIT_SHARED keeps the buckets in the
+    # shared cache so the limits hold across workers, else each worker keeps up to RATE_LIMIT_KEYS of its own
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", True)
+    RATE_LIMIT_SHARED: bool = os.getenv("RATE_LIMIT_SHARED", False)
+    RATE_LIMIT_KEYS: int = os.getenv("RATE_LIMIT_KEYS", 100000)
+    LOGIN_IP_PER_MINUTE: int = os.getenv("LOGIN_IP_PER_MINUTE", 10)
+    LOGIN_IP_BURST: int = os.getenv("LOGIN_IP_BURST", 5)
+    LOGIN_USERNAME_PER_MINUTE: int = os.getenv("LOGIN_USERNAME_PER_MINUTE", 5)
+    LOGIN_USERNAME_BURST: int = os.getenv("LOGIN_USERNAME_BURST", 10)
+    REGISTRATION_IP_PER_MINUTE: int = os.getenv("REGISTRATION_IP_PER_MINUTE", 10)
+    REGISTRATION_IP_BURST: int = os.getenv("REGISTRATION_IP_BURST", 5)
+
+    # Process pool used for bcrypt, and how many hashes may wait for it before requests get a 503
+    HASHING_WORKERS: int = os.getenv("HASHING_WORKERS", os.cpu_count() or 1)
+    HASHING_QUEUE_SIZE: int = os.getenv("HASHING_QUEUE_SIZE", 64)
+
+    # In-process index of accepted friendships used by if_friends and view_friends, rebuilt periodically
+    FRIEND_GRAPH_ENABLED: bool = os.getenv("FRIEND_GRAPH_ENABLED", False)
+    FRIEND_GRAPH_REFRESH_SECONDS: int = os.getenv("FRIEND_GRAPH_REFRESH_SECONDS", 300)
+
+    # "People you may know": suggestions kept per user, and how often the app rebuilds the mutual-friend matrix in
+    # the background when friendships were accepted since the last build
+    SUGGESTIONS_MAX: int = os.getenv("SUGGESTIONS_MAX", 100)
+    SUGGESTIONS_CACHE_SIZE: int = os.getenv("SUGGESTIONS_CACHE_SIZE", 10000)
+    SUGGESTIONS_REFRESH_SECONDS: int = os.getenv("SUGGESTIONS_REFRESH_SECONDS", 300)
+
+    # Users whose friendship counters are recomputed per transaction by the reconciliation job, and how often the
+    # app runs it (0 leaves it to `python -m src.crud.stats`)
+    FRIENDSHIP_STATS_RECONCILE_BATCH_SIZE: int = os.getenv("FRIENDSHIP_STATS_RECONCILE_BATCH_SIZE", 1000)
+    FRIENDSHIP_STATS_RECONCILE_SECONDS: int = os.getenv("FRIENDSHIP_STATS_RECONCILE_SECONDS", 0)
+
+    # Ids GET /users/batch resolves in one request
+    USER_BATCH_MAX_IDS: int = os.getenv("USER_BATCH_MAX_IDS", 200)
+
+    # Rows validated, hashed and inserted together by POST /users/bulk
+    BULK_IMPORT_BATCH_SIZE: int = os.getenv("BULK_IMPORT_BATCH_SIZE", 1000)
+
     class Config:
         case_sensitive = True
         env_file = ".env"
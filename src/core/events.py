@@ -0,0 +1,164 @@
+import asyncio
+import json
+import uuid
+from typing import AsyncIterator, Dict, Iterable, Optional, Set
+
+from src.core.cache import shared_cache
+from src.core.config import settings
+from src.core.metrics import Collected, registry
+
+
+HEARTBEAT = ":\n\n"
+
+
+class HubFull(Exception):
+    """
+    Raised when a worker already holds as many event streams as it accepts.
+    """
+
+
+class Subscription:
+    """
+    One open event stream. Holds the frames not sent yet, None closes the stream.
+    """
+
+    __slots__ = ("user_id", "queue")
+
+    def __init__(self, user_id: uuid.UUID, queue_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=queue_size)
+
+
+class EventHub:
+    """
+    Fans server-sent events out to the streams open in this worker, keyed by user id.
+    Events are published through the shared cache's pub/sub, so with the Redis backend they reach the streams
+    of every worker. A stream that falls `queue_size` events behind is closed instead of buffering without bound;
+    clients reconnect and resync with GET /friends/requests.
+    """
+
+    def __init__(self, queue_size: int, max_connections: int):
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self._subscriptions: Dict[uuid.UUID, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connections = 0
+        self.delivered = 0
+        self.dropped = 0
+        shared_cache.subscribe("events", self._on_message)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """
+        Deliver to the streams served by `loop`, the events arrive on whichever thread published them.
+        """
+        self._loop = loop
+
+    def stop(self):
+        self._loop = None
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                self._close(subscription)
+
+    def publish(self, user_ids: Iterable[uuid.UUID], event: str, data: str):
+        """
+        Send an event to every stream of the given users, in every worker. Safe to call from any thread.
+        """
+        shared_cache.publish("events", json.dumps({"users": [str(user_id) for user_id in user_ids],
+                                                   "event": event, "data": data}))
+
+    def _on_message(self, message: str):
+        loop = self._loop
+        if loop is None:
+            return
+
+        message = json.loads(message)
+        # Render the frame once for all the streams it goes to
+        frame = "".join([f"event: {message['event']}\n",
+                         *(f"data: {line}\n" for line in message["data"].splitlines()), "\n"])
+        loop.call_soon_threadsafe(self._deliver, [uuid.UUID(user_id) for user_id in message["users"]], frame)
+
+    def _deliver(self, user_ids, frame: str):
+        for user_id in user_ids:
+            for subscription in list(self._subscriptions.get(user_id, ())):
+                self._put(subscription, frame)
+
+    def _put(self, subscription: Subscription, frame: str):
+        try:
+            subscription.queue.put_nowait(frame)
+            self.delivered += 1
+        except asyncio.QueueFull:
+            # A slow consumer, drop it rather than buffer for it
+            self.dropped += 1
+            self._close(subscription)
+
+    def _close(self, subscription: Subscription):
+        self._unsubscribe(subscription)
+        if subscription.queue.full():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def _unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions and subscription in subscriptions:
+            subscriptions.discard(subscription)
+            self.connections -= 1
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    @property
+    def full(self) -> bool:
+        return self.connections >= self.max_connections
+
+    def subscribe(self, user_id: uuid.UUID) -> Subscription:
+        if self.full:
+            raise HubFull()
+
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        self.connections += 1
+        return subscription
+
+    async def stream(self, user_id: uuid.UUID) -> AsyncIterator[str]:
+        """
+        The events of a user, as the body of a text/event-stream response.
+        The subscription is only taken once the body starts, so a client that goes away before that holds no slot.
+        """
+        retry = f"retry: {settings.EVENTS_RETRY_MILLISECONDS}\n\n"
+        try:
+            subscription = self.subscribe(user_id)
+        except HubFull:
+            # Filled up since the endpoint checked, the client reconnects after the delay
+            yield retry
+            return
+
+        try:
+            yield retry
+            while True:
+                frame = await subscription.queue.get()
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self._unsubscribe(subscription)
+
+    async def heartbeat(self, interval: float):
+        """
+        Send a comment to every stream now and then, so proxies keep idle streams open and dead ones are noticed.
+        One task for all the streams instead of a timer per stream.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            for subscriptions in list(self._subscriptions.values()):
+                for subscription in list(subscriptions):
+                    if not subscription.queue.full():
+                        subscription.queue.put_nowait(HEARTBEAT)
+
+
+event_hub = EventHub(queue_size=settings.EVENTS_QUEUE_SIZE, max_connections=settings.EVENTS_MAX_CONNECTIONS)
+
+registry.register(Collected("events_connections", "Event streams open in this worker.", "gauge",
+                            lambda: [({}, event_hub.connections)]))
+registry.register(Collected("events_delivered_total", "Events queued for an event stream.", "counter",
+                            lambda: [({}, event_hub.delivered)]))
+registry.register(Collected("events_dropped_total", "Event streams closed because they fell behind.", "counter",
+                            lambda: [({}, event_hub.dropped)]))
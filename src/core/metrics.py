@@ -0,0 +1,141 @@
+import math
+from bisect import bisect_left
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus text format, one series per combination of label values.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.labels = tuple(labels)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # One counter per bucket, then the sum and the count
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+
+            # Count each value in its own bucket only, the cumulative counts are summed up when rendering
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+
+        for label_values, values in sorted(series.items()):
+            labels = dict(zip(self.labels, label_values))
+            count = 0
+            for bound, bucket in zip(self.buckets, values):
+                count += bucket
+                yield f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {count}"
+            yield f"{self.name}_sum{_format_labels(labels)} {values[-2]!r}"
+            yield f"{self.name}_count{_format_labels(labels)} {values[-1]}"
+
+
+class Collected:
+    """
+    Gauge or counter whose samples are read when the metrics are scraped, e.g. pool sizes or cache counters.
+    The callback returns (labels, value) pairs.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str,
+                 collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in self.collect():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Registry:
+    """
+    Metrics exposed by GET /metrics.
+    """
+
+    def __init__(self):
+        self._metrics: List[Histogram | Collected] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time spent serving a request, by route.",
+    LATENCY_BUCKETS, labels=("method", "route")))
+
+request_statements = registry.register(Histogram(
+    "http_request_sql_statements", "SQL statements executed while serving a request, by route.",
+    STATEMENT_BUCKETS, labels=("method", "route")))
+
+request_db_time = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent executing SQL statements while serving a request, by route.",
+    LATENCY_BUCKETS, labels=("method", "route")))
+
+pool_checkout_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the pool.",
+    LATENCY_BUCKETS, labels=("engine",)))
+
+_caches: Dict[str, object] = {}
+
+
+def register_cache(name: str, cache):
+    """
+    Expose the counters of a TTLCache in /metrics.
+    """
+    _caches[name] = cache
+
+
+def _cache_samples(key: str):
+    for name, cache in _caches.items():
+        yield {"cache": name}, cache.stats()[key]
+
+
+registry.register(Collected("cache_entries", "Entries held by an in-process cache.", "gauge",
+                            lambda: _cache_samples("size")))
+for _key in ("hits", "misses", "evictions", "expirations"):
+    registry.register(Collected(f"cache_{_key}_total", f"Cache {_key} of an in-process cache.", "counter",
+                                lambda key=_key: _cache_samples(key)))
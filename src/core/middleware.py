@@ -0,0 +1,44 @@
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.core.metrics import request_db_time, request_duration, request_statements
+from src.database.instrumentation import track_queries
+
+
+class QueryMetricsMiddleware:
+    """
+    Count the SQL statements and DB time of every request. Adds them to the response as a Server-Timing header
+    and records them, with the request duration, in the per-route histograms of /metrics.
+    A plain ASGI middleware, so streamed responses are not buffered.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        with track_queries() as stats:
+            async def send_with_timing(message: Message):
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing",
+                                   f'db;dur={stats.duration * 1000:.1f};desc="{stats.statements} queries", '
+                                   f'app;dur={(time.perf_counter() - start) * 1000:.1f}')
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                # The route is known once the router matched the request, unmatched paths share one series
+                route = getattr(scope.get("route"), "path", "unmatched")
+                method = scope["method"]
+                request_duration.observe(time.perf_counter() - start, method, route)
+                request_statements.observe(stats.statements, method, route)
+                request_db_time.observe(stats.duration, method, route)
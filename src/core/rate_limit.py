@@ -0,0 +1,105 @@
+import math
+import threading
+from typing import Dict
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
+
+from src.core.cache import CacheBackend, MemoryBackend, shared_cache
+from src.core.config import settings
+from src.core.metrics import Collected, registry
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by client IP or username: `per_minute` attempts a minute on average, `burst` at once.
+    The buckets are kept by a cache backend, in process by default or in the shared cache with RATE_LIMIT_SHARED.
+    """
+
+    def __init__(self, name: str, per_minute: int, burst: int, backend: CacheBackend):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.backend = backend
+        self.allowed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, cost: int = 1) -> float:
+        """
+        Take `cost` attempts for `key`. Returns 0 when allowed, else the seconds to wait.
+        """
+        key = f"ratelimit:{self.name}:{key}"
+        if self.backend.remote:
+            retry_after = await run_in_threadpool(self.backend.take, key, self.rate, self.burst, cost)
+        else:
+            retry_after = self.backend.take(key, self.rate, self.burst, cost)
+
+        with self._lock:
+            if retry_after:
+                self.rejected += 1
+            elif cost:
+                self.allowed += 1
+        return retry_after
+
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(status_code=429, detail="Too many attempts, try again later",
+                         headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+def client_ip(request: Request) -> str:
+    # Behind a proxy, run uvicorn with --proxy-headers so this is the address from X-Forwarded-For
+    return request.client.host if request.client else "unknown"
+
+
+_backend = shared_cache if settings.RATE_LIMIT_SHARED else MemoryBackend(maxsize=settings.RATE_LIMIT_KEYS)
+
+login_ip_limiter = RateLimiter("login_ip", settings.LOGIN_IP_PER_MINUTE, settings.LOGIN_IP_BURST, _backend)
+login_username_limiter = RateLimiter("login_username", settings.LOGIN_USERNAME_PER_MINUTE,
+                                     settings.LOGIN_USERNAME_BURST, _backend)
+registration_ip_limiter = RateLimiter("registration_ip", settings.REGISTRATION_IP_PER_MINUTE,
+                                      settings.REGISTRATION_IP_BURST, _backend)
+
+_limiters: Dict[str, RateLimiter] = {limiter.name: limiter
+                                     for limiter in (login_ip_limiter, login_username_limiter, registration_ip_limiter)}
+
+
+async def limit_login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    """
+    Reject a login attempt before it reaches the database or bcrypt when its IP made too many attempts,
+    or its username failed too many times. Only failures count against a username (see login_failed),
+    so an attacker can't spend the attempts of a user who logs in successfully.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+
+    retry_after = await login_username_limiter.take(form_data.username.lower(), cost=0)
+    if not retry_after:
+        retry_after = await login_ip_limiter.take(client_ip(request))
+    if retry_after:
+        raise too_many_requests(retry_after)
+
+
+async def login_failed(username: str):
+    if settings.RATE_LIMIT_ENABLED:
+        await login_username_limiter.take(username.lower())
+
+
+async def limit_registration(request: Request):
+    """
+    Reject a registration before it is validated against the database and hashed when its IP made too many.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+
+    retry_after = await registration_ip_limiter.take(client_ip(request))
+    if retry_after:
+        raise too_many_requests(retry_after)
+
+
+registry.register(Collected("rate_limit_allowed_total", "Attempts let through by a rate limiter.", "counter",
+                            lambda: [({"limiter": name}, limiter.allowed) for name, limiter in _limiters.items()]))
+registry.register(Collected("rate_limit_rejected_total", "Attempts rejected with 429 by a rate limiter.", "counter",
+                            lambda: [({"limiter": name}, limiter.rejected) for name, limiter in _limiters.items()]))
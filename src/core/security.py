@@ -0,0 +1,125 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+
+from passlib.context import CryptContext
+
+from src.core.config import settings
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Passwords of a batch hashed by one task of the pool, a fraction of a second of bcrypt each
+BATCH_CHUNK_SIZE = 4
+
+
+class HashingPoolSaturated(Exception):
+    """
+    Raised when the hashing pool already has as many hashes running and queued as it accepts.
+    """
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hash_password: str) -> bool:
+    return pwd_context.verify(password, hash_password)
+
+
+def _hash_many(passwords: List[str]) -> List[str]:
+    return [pwd_context.hash(password) for password in passwords]
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+class HashingExecutor:
+    """
+    Process pool dedicated to bcrypt, so hashing never holds the GIL of a worker serving requests.
+    Accepts at most `workers + queue_size` hashes at a time and rejects the rest instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def start(self):
+        """
+        Start the worker processes up front, at startup, instead of on the first login.
+        """
+        self._get_executor().submit(_warm_up).result()
+
+    async def run(self, fn: Callable, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolSaturated()
+
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        finally:
+            self._slots.release()
+
+    async def run_waiting(self, fn: Callable, *args):
+        """
+        Like run, but wait for a free slot instead of raising. For batch jobs that must not be rejected.
+        """
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+hashing_executor = HashingExecutor(workers=settings.HASHING_WORKERS, queue_size=settings.HASHING_QUEUE_SIZE)
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash a password in the hashing pool. Raises HashingPoolSaturated if the pool is full.
+    """
+    return await hashing_executor.run(_hash, password)
+
+
+async def check_password(password: str, hash_password: str) -> bool:
+    """
+    Verify a password in the hashing pool. Raises HashingPoolSaturated if the pool is full.
+    """
+    return await hashing_executor.run(_verify, password, hash_password)
+
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    """
+    Hash a batch of passwords across the workers of the hashing pool, in input order.
+    Waits for free slots rather than failing, so a large batch only delays, never rejects, other hashes.
+    The batch goes in chunks of a few passwords with at most one per worker in flight, so a login or a
+    registration waits behind one chunk, not behind the whole batch, and still finds a queue slot.
+    """
+    in_flight = asyncio.Semaphore(hashing_executor.workers)
+
+    async def hash_chunk(chunk: List[str]) -> List[str]:
+        async with in_flight:
+            return await hashing_executor.run_waiting(_hash_many, chunk)
+
+    chunks = [passwords[i:i + BATCH_CHUNK_SIZE] for i in range(0, len(passwords), BATCH_CHUNK_SIZE)]
+    hashed = await asyncio.gather(*(hash_chunk(chunk) for chunk in chunks))
+    return [password_hash for chunk in hashed for password_hash in chunk]
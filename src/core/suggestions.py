@@ -0,0 +1,162 @@
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from src.core.cache import TTLCache
+from src.core.metrics import register_cache
+from src.core.config import settings
+
+
+class SuggestionEngine:
+    """
+    Ranks non-friends of a user by their number of mutual friends.
+
+    Accepted friendships are loaded into a symmetric CSR adjacency matrix A; the mutual-friend counts of a block
+    of users are the rows of A[block] @ A, minus the users themselves and their friends.
+    The matrix is rebuilt on a schedule by a background task of the app, and requests keep using the current one
+    meanwhile. Friendships accepted in between are only excluded from the results, and the top suggestions of
+    every user are cached until the next rebuild.
+    """
+
+    def __init__(self, max_suggestions: int, cache_size: int, refresh_seconds: int):
+        self.max_suggestions = max_suggestions
+        self.refresh_seconds = refresh_seconds
+        self._build_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._index: Dict[uuid.UUID, int] = {}
+        self._ids: List[uuid.UUID] = []
+        self._matrix: csr_matrix | None = None
+        self._built_at = 0.0
+        self._new_edges: Dict[int, Set[int]] = defaultdict(set)
+        # A friendship was accepted since the edges of the current matrix were loaded, between any two users,
+        # including ones the matrix doesn't know yet
+        self._dirty = False
+        self._cache = TTLCache(maxsize=cache_size, ttl=refresh_seconds)
+
+    def needs_build(self) -> bool:
+        with self._lock:
+            if self._matrix is None:
+                return True
+            return self._dirty and time.monotonic() - self._built_at > self.refresh_seconds
+
+    def build(self, edges: Iterable[Tuple[uuid.UUID, uuid.UUID]]):
+        """
+        Replace the adjacency matrix with the given edges.
+        """
+        index: Dict[uuid.UUID, int] = {}
+        ids: List[uuid.UUID] = []
+        rows: List[int] = []
+        columns: List[int] = []
+
+        for first_user, second_user in edges:
+            for user_id in (first_user, second_user):
+                if user_id not in index:
+                    index[user_id] = len(ids)
+                    ids.append(user_id)
+            rows.append(index[first_user])
+            columns.append(index[second_user])
+
+        size = len(ids)
+        first = np.array(rows, dtype=np.int32)
+        second = np.array(columns, dtype=np.int32)
+        matrix = csr_matrix((np.ones(2 * len(first), dtype=np.int32),
+                             (np.concatenate([first, second]), np.concatenate([second, first]))),
+                            shape=(size, size))
+        # Duplicate edges are summed by the constructor, the adjacency matrix only needs to know they exist
+        matrix.data[:] = 1
+
+        with self._lock:
+            self._index, self._ids, self._matrix = index, ids, matrix
+            self._built_at = time.monotonic()
+            self._new_edges.clear()
+            self._cache.clear()
+
+    def rebuild_if_needed(self, load_edges):
+        """
+        Rebuild from `load_edges()` unless another thread just did it.
+        """
+        with self._build_lock:
+            if self.needs_build():
+                self._rebuild(load_edges)
+
+    def rebuild(self, load_edges):
+        """
+        Rebuild from `load_edges()` now, after any rebuild already running.
+        """
+        with self._build_lock:
+            self._rebuild(load_edges)
+
+    def _rebuild(self, load_edges):
+        # Cleared before loading, a friendship accepted while the edges are read asks for the next rebuild
+        with self._lock:
+            self._dirty = False
+        self.build(load_edges())
+
+    def add_edge(self, first_user: uuid.UUID, second_user: uuid.UUID):
+        """
+        Record a friendship accepted after the last build, so the two users stop suggesting each other.
+        """
+        with self._lock:
+            self._dirty = True
+            first, second = self._index.get(first_user), self._index.get(second_user)
+            if first is not None and second is not None:
+                self._new_edges[first].add(second)
+                self._new_edges[second].add(first)
+            self._cache.delete(first_user)
+            self._cache.delete(second_user)
+
+    def _compute(self, numbers: np.ndarray) -> List[List[Tuple[int, int]]]:
+        """
+        Mutual-friend counts for a block of users, as (user number, count) pairs ranked by count.
+        """
+        friends = self._matrix[numbers]
+        mutual = (friends @ self._matrix).tocsr()
+
+        results = []
+        for row, number in enumerate(numbers):
+            start, end = mutual.indptr[row], mutual.indptr[row + 1]
+            candidates, counts = mutual.indices[start:end], mutual.data[start:end]
+
+            excluded = friends.indices[friends.indptr[row]:friends.indptr[row + 1]]
+            keep = ~np.isin(candidates, excluded) & (candidates != number)
+            if number in self._new_edges:
+                keep &= ~np.isin(candidates, list(self._new_edges[number]))
+            candidates, counts = candidates[keep], counts[keep]
+
+            if len(counts) > self.max_suggestions:
+                top = np.argpartition(-counts, self.max_suggestions - 1)[:self.max_suggestions]
+                candidates, counts = candidates[top], counts[top]
+
+            order = np.lexsort((candidates, -counts))
+            results.append(list(zip(candidates[order].tolist(), counts[order].tolist())))
+
+        return results
+
+    def suggest(self, user_id: uuid.UUID, limit: int) -> List[Tuple[uuid.UUID, int]]:
+        """
+        Get up to `limit` suggested user ids with their mutual-friend counts.
+        """
+        suggestions = self._cache.get(user_id)
+
+        if suggestions is None:
+            with self._lock:
+                number = self._index.get(user_id)
+                if self._matrix is None or number is None:
+                    return []
+
+                ranked = self._compute(np.array([number], dtype=np.int32))[0]
+                suggestions = [(self._ids[candidate], count) for candidate, count in ranked]
+                self._cache.set(user_id, suggestions)
+
+        return suggestions[:limit]
+
+
+suggestion_engine = SuggestionEngine(max_suggestions=settings.SUGGESTIONS_MAX,
+                                     cache_size=settings.SUGGESTIONS_CACHE_SIZE,
+                                     refresh_seconds=settings.SUGGESTIONS_REFRESH_SECONDS)
+register_cache("suggestions", suggestion_engine._cache)
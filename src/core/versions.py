@@ -0,0 +1,72 @@
+"""
+Version counters bumped by the write paths, from which the polled read endpoints derive their ETags.
+A 304 only needs the counters, so conditional requests skip the list queries.
+The counters live in the shared cache, so every worker hands out the same ETags, and the epoch of the cache
+in every ETag makes the tags from before a restart of the memory backend, or a Redis flush, never match.
+The same versions are part of the keys of the cached users, principals and friend lists: a reader takes the
+version before it queries and caches under it, so what it read before a write committed is cached under a version
+the write has retired, where nobody looks anymore. Deleting the entry instead would race with that reader.
+"""
+
+import uuid
+from typing import List
+
+from starlette.requests import Request
+
+from src.core.cache import shared_cache
+
+def _etag(keys: List[str]) -> str:
+    epoch, counters = shared_cache.counters(keys)
+    return '"' + "-".join([epoch, *(str(counter) for counter in counters)]) + '"'
+
+
+def profile_changed(user_id: uuid.UUID):
+    # Must follow every committed change to a user, it also retires the cached principals.
+    # The lists that embed the profile are bumped by the caller, see src/crud/user.py user_changed
+    shared_cache.incr(f"version:profile:{user_id}")
+
+
+def friends_changed(*user_ids: uuid.UUID):
+    shared_cache.incr(*(f"version:friends:{user_id}" for user_id in user_ids))
+
+
+def friend_requests_changed(*user_ids: uuid.UUID):
+    shared_cache.incr(*(f"version:friend_requests:{user_id}" for user_id in user_ids))
+
+
+def _versions(keys: List[str]) -> List[str]:
+    epoch, counters = shared_cache.counters(keys)
+    return [f"{epoch}-{counter}" for counter in counters]
+
+
+def profile_versions(user_ids: List[uuid.UUID]) -> List[str]:
+    return _versions([f"version:profile:{user_id}" for user_id in user_ids])
+
+
+def friends_version(user_id: uuid.UUID) -> str:
+    return _versions([f"version:friends:{user_id}"])[0]
+
+
+def profile_etag(user_id: uuid.UUID) -> str:
+    return _etag([f"version:profile:{user_id}"])
+
+
+def friends_etag(user_id: uuid.UUID) -> str:
+    return _etag([f"version:friends:{user_id}"])
+
+
+def friend_requests_etag(user_id: uuid.UUID) -> str:
+    return _etag([f"version:friend_requests:{user_id}"])
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    """
+    Check whether the client already has the representation tagged `etag`.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, W/ prefixes don't matter
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
@@ -0,0 +1,157 @@
+import csv
+import io
+import json
+import uuid
+import zlib
+from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator, Iterable, Iterator, List
+
+from sqlalchemy import Select, select
+from sqlalchemy.orm import aliased
+from starlette.responses import StreamingResponse
+
+from src.common.responses import ForbiddenAccess, Unauthorized
+from src.core.config import settings
+from src.crud.user import is_admin, is_moderator
+from src.database.session import AsyncSessionLocal, SessionLocal
+from src.models.export import ExportFormat
+from src.models.friends import Friendship
+from src.models.user import User
+
+
+EXPORT_BATCH_SIZE = 1000
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+def users_export_statement() -> Select:
+    return select(User.id, User.firstname, User.lastname, User.username, User.email,
+                  User.role, User.state, User.type).order_by(User.username, User.id)
+
+
+def friendships_export_statement() -> Select:
+    sender, receiver = aliased(User), aliased(User)
+    return (select(Friendship.id, Friendship.created,
+                   Friendship.user_id.label("sender_id"), sender.username.label("sender_username"),
+                   Friendship.receiver_id, receiver.username.label("receiver_username"),
+                   Friendship.status, Friendship.responded)
+            .join(sender, sender.id == Friendship.user_id)
+            .join(receiver, receiver.id == Friendship.receiver_id)
+            .order_by(Friendship.created, Friendship.id))
+
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _encode(rows: Iterable, columns: List[str], file_format: ExportFormat) -> bytes:
+    """
+    Encode a partition of rows as NDJSON lines or CSV records.
+    """
+    if file_format == ExportFormat.CSV:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([[_plain(value) for value in row] for row in rows])
+        return buffer.getvalue().encode()
+
+    return "".join(json.dumps(dict(zip(columns, map(_plain, row)))) + "\n" for row in rows).encode()
+
+
+def _stream(statement: Select, columns: List[str], file_format: ExportFormat) -> Iterator[bytes]:
+    """
+    Stream a statement through a server-side cursor of a session owned by the generator,
+    since the request session is closed before a streaming response is sent.
+    """
+    if file_format == ExportFormat.CSV:
+        yield _encode([columns], columns, file_format)
+
+    with SessionLocal() as db:
+        result = db.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for partition in result.partitions():
+            yield _encode(partition, columns, file_format)
+
+
+async def _stream_async(statement: Select, columns: List[str], file_format: ExportFormat) -> AsyncIterator[bytes]:
+    if file_format == ExportFormat.CSV:
+        yield _encode([columns], columns, file_format)
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for partition in result.partitions():
+            yield _encode(partition, columns, file_format)
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def _gzip_async(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(statement: Select, name: str, file_format: ExportFormat, compress: bool) -> StreamingResponse:
+    """
+    Build a streaming response for a statement. Memory use is bounded by one partition of rows,
+    whatever the size of the table.
+    """
+    columns = [column.name for column in statement.selected_columns]
+
+    if settings.DATABASE_ASYNC:
+        body = _stream_async(statement, columns, file_format)
+        if compress:
+            body = _gzip_async(body)
+    else:
+        body = _stream(statement, columns, file_format)
+        if compress:
+            body = _gzip(body)
+
+    headers = {"Content-Disposition": f'attachment; filename="{name}.{file_format.value}"'}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(body, media_type=MEDIA_TYPES[file_format], headers=headers)
+
+
+def export_users(current_user: User, file_format: ExportFormat, compress: bool):
+    """
+    Export the users directory. Admins and moderators only.
+    """
+    if not current_user:
+        return Unauthorized()
+
+    if not is_admin(current_user) and not is_moderator(current_user):
+        return ForbiddenAccess()
+
+    return stream_export(users_export_statement(), "users", file_format, compress)
+
+
+def export_friendships(current_user: User, file_format: ExportFormat, compress: bool):
+    """
+    Export the friendships log. Admins and moderators only.
+    """
+    if not current_user:
+        return Unauthorized()
+
+    if not is_admin(current_user) and not is_moderator(current_user):
+        return ForbiddenAccess()
+
+    return stream_export(friendships_export_statement(), "friendships", file_format, compress)
@@ -1,39 +1,86 @@
-from src.schemas.friends import FriendRequest, FriendRequestResponse
-from src.models.friends import Friendship, FriendshipStatus, FriendRequestAction
+from src.schemas.friends import (FriendRequest, FriendRequestResponse, FriendSuggestion, BulkFriendRequestResult)
+from src.models.friends import Friendship, FriendshipStatus, FriendRequestAction, canonical_pair
 
-from pydantic import EmailStr
-from sqlalchemy import or_
+from pydantic import EmailStr, TypeAdapter
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+import json
 import logging
 from datetime import datetime
 
-from typing import List, Type
+from typing import List, Optional, Type
 import uuid
 
-from src.common.responses import AlreadyExists, NotFound, Unauthorized, BadRequest, ForbiddenAccess
+from src.common.pagination import DEFAULT_PAGE_SIZE, paginate
+from src.core.friend_graph import friend_graph
+from src.core.cache import shared_cache
+from src.core.config import settings
+from src.core.events import event_hub
+from src.core.suggestions import suggestion_engine
+from src.core.versions import friends_changed, friend_requests_changed, friends_version
+from src.crud.stats import StatsDelta
+from src.database.routing import read_only
+from src.common.responses import AlreadyExists, NotFound, Unauthorized, BadRequest, ForbiddenAccess, JSONBytes
 from src.core.authentication import (get_password_hash, get_current_user, verify_password, authenticate_user, create_access_token)
 
-from src.models.user import User, Role
+from src.models.user import User, Role, State
 from src.models.search import SearchType
 
+from src.schemas.page import Page
 from src.schemas.user import (CreateUserRequest, LoginRequest, UserResponse, UpdateEmailRequest)
-from src.crud.user import get_user_by_id, is_admin, is_moderator
+from src.crud.user import get_user_loader, is_admin, is_moderator
 
 logger = logging.getLogger(__name__)
 
+user_list_adapter = TypeAdapter(List[UserResponse])
+friend_request_list_adapter = TypeAdapter(List[FriendRequestResponse])
+friend_request_page_adapter = TypeAdapter(Page[FriendRequestResponse])
+suggestion_list_adapter = TypeAdapter(List[FriendSuggestion])
+bulk_result_list_adapter = TypeAdapter(List[BulkFriendRequestResult])
+
+
+def format_timestamp(value: datetime):
+    """
+    Format a datetime as "%H:%M:%S %d-%m-%Y", about twice as fast as strftime.
+    """
+    return "%02d:%02d:%02d %02d-%02d-%d" % (value.hour, value.minute, value.second, value.day, value.month, value.year)
+
 
 def format_friend_request_response(db: Session, friend_request: Friendship | Type[Friendship]):
+    loader = get_user_loader(db)
+    loader.load_many({friend_request.user_id, friend_request.receiver_id})
     return FriendRequestResponse(id=friend_request.id,
-                                 created=friend_request.created.strftime("%H:%M:%S %d-%m-%Y"),
-                                 sender=get_user_by_id(db, friend_request.user_id),
-                                 receiver=get_user_by_id(db, friend_request.receiver_id),
+                                 created=format_timestamp(friend_request.created),
+                                 sender=loader.load(friend_request.user_id),
+                                 receiver=loader.load(friend_request.receiver_id),
                                  status=friend_request.status,
-                                 responded=friend_request.responded.strftime("%H:%M:%S %d-%m-%Y")
+                                 responded=format_timestamp(friend_request.responded)
                                  if friend_request.responded
                                  else friend_request.responded)
 
-def get_friendships_log(db: Session, current_user: User):
+
+def push_friend_request(event: str, response: FriendRequestResponse, *user_ids: uuid.UUID) -> FriendRequestResponse:
+    """
+    Send a friend request to the event streams of the given users, as a "friend_request.<event>" event.
+    """
+    event_hub.publish(user_ids, f"friend_request.{event}", response.model_dump_json())
+    return response
+
+
+def format_friend_request_responses(db: Session, friend_requests: List[Friendship] | List[Type[Friendship]]):
+    """
+    Format a list of friend requests, resolving all senders and receivers with one query.
+    """
+    get_user_loader(db).load_many({user_id
+                                   for friend_request in friend_requests
+                                   for user_id in (friend_request.user_id, friend_request.receiver_id)})
+
+    return [format_friend_request_response(db, friend_request)
+            for friend_request in friend_requests]
+
+@read_only
+def get_friendships_log(db: Session, current_user: User, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
 
     if not current_user:
         return Unauthorized()
@@ -41,11 +88,47 @@ def get_friendships_log(db: Session, current_user: User):
     if not is_admin(current_user) and not is_moderator(current_user):
         return ForbiddenAccess()
 
-    friendships = db.query(Friendship).all()
+    """
+    Get a page of the friendships log, ordered by (created, id).
+    """
+
+    try:
+        friendships, next_cursor = paginate(db.query(Friendship), (Friendship.created, Friendship.id), cursor, limit)
+    except ValueError:
+        return BadRequest("Invalid cursor.")
+
+    return JSONBytes(friend_request_page_adapter.dump_json(
+        Page[FriendRequestResponse](items=format_friend_request_responses(db, friendships), next_cursor=next_cursor)))
+
+
+
+def friend_ids_cache_key(user_id: uuid.UUID, version: str) -> str:
+    return f"friends:{user_id}:{version}"
+
+
+def get_friend_ids(db: Session, user_id: uuid.UUID) -> List[uuid.UUID]:
+    """
+    Ids of the friends of a user, from the friend graph when it is built, else from the shared cache or the database.
+    Must not run on a replica: what it reads is cached for every worker.
+    """
+    if friend_graph.ready:
+        return friend_graph.friends_of(user_id)
+
+    # Taken before the query, see src/core/versions.py
+    cache_key = friend_ids_cache_key(user_id, friends_version(user_id))
+    cached, = shared_cache.get_many([cache_key])
+    if cached is not None:
+        return [uuid.UUID(friend_id) for friend_id in json.loads(cached)]
 
-    return [format_friend_request_response(db, friendship)
-            for friendship in friendships]
+    friends = db.query(Friendship.user_id, Friendship.receiver_id).filter(
+        (Friendship.user_id == user_id) | (Friendship.receiver_id == user_id),
+        Friendship.status == FriendshipStatus.ACCEPTED
+    ).all()
 
+    friend_ids = list({receiver_id if sender_id == user_id else sender_id for sender_id, receiver_id in friends})
+    shared_cache.set_many({cache_key: json.dumps([str(friend_id) for friend_id in friend_ids]).encode()},
+                          ttl=settings.CACHE_TTL)
+    return friend_ids
 
 
 def view_friends(db: Session, current_user: User):
@@ -56,20 +139,12 @@ def view_friends(db: Session, current_user: User):
     View a list of friends.
     """
 
-    friends = db.query(Friendship).filter(
-        (Friendship.user_id == current_user.id) | (Friendship.receiver_id == current_user.id),
-        Friendship.status == FriendshipStatus.ACCEPTED
-    ).all()
-
-    friend_ids = {
-        friend.receiver_id if friend.user_id == current_user.id else friend.user_id
-        for friend in friends
-    }
+    friend_ids = get_friend_ids(db, current_user.id)
 
     if not friend_ids:
         return NotFound(key="Friends", key_value="")
 
-    return [get_user_by_id(db, friend_id) for friend_id in friend_ids]
+    return JSONBytes(user_list_adapter.dump_json(get_user_loader(db).load_many(friend_ids)))
 
 def view_friend_requests(db: Session, current_user: User):
 
@@ -86,8 +161,30 @@ def view_friend_requests(db: Session, current_user: User):
     if not friend_requests:
         return NotFound(key="Friend requests", key_value="")
 
-    return [format_friend_request_response(db, friend_request)
-            for friend_request in friend_requests]
+    return JSONBytes(friend_request_list_adapter.dump_json(format_friend_request_responses(db, friend_requests)))
+
+def set_friend_request_status(db: Session, friend_request: Friendship | Type[Friendship], status: FriendshipStatus):
+
+    """
+    Move a friend request to `status` and update the friendship counters of both users in the same transaction.
+    The update only applies while the request still has the status it was read with, so of two concurrent
+    answers only one is counted. Returns False, with nothing changed, when the other one won.
+    """
+
+    previous = friend_request.status
+    changed = db.execute(update(Friendship)
+                         .where(Friendship.id == friend_request.id, Friendship.status == previous)
+                         .values(status=status, responded=datetime.now())).rowcount
+
+    if changed:
+        stats = StatsDelta()
+        stats.transition(friend_request.user_id, friend_request.receiver_id, previous, status)
+        stats.apply(db)
+
+    db.commit()
+    db.refresh(friend_request)
+    return bool(changed)
+
 
 def accept_friend_request(db: Session, current_user: User, friend_request: Friendship | Type[Friendship]):
 
@@ -104,12 +201,30 @@ def accept_friend_request(db: Session, current_user: User, friend_request: Frien
     if not friend_request:
         return NotFound(key="Friend request", key_value="")
 
-    friend_request.status = FriendshipStatus.ACCEPTED
-    friend_request.responded = datetime.now()
-    db.commit()
-    db.refresh(friend_request)
+    if not set_friend_request_status(db, friend_request, FriendshipStatus.ACCEPTED):
+        return NotFound(key="Friend request", key_value="")
+
+    add_friendship(f"{friend_request.user_id}:{friend_request.receiver_id}")
+    shared_cache.publish("friendship", f"{friend_request.user_id}:{friend_request.receiver_id}")
+    friends_changed(friend_request.user_id, friend_request.receiver_id)
+    friend_requests_changed(friend_request.receiver_id)
 
-    return format_friend_request_response(db, friend_request)
+    return push_friend_request("accepted", format_friend_request_response(db, friend_request),
+                               friend_request.user_id, friend_request.receiver_id)
+
+
+def add_friendship(users: str):
+    """
+    Add an accepted friendship, as "sender_id:receiver_id", to the in-process friend graph and suggestions.
+    Runs in the worker that accepted it, then in every worker when the message published by the accept arrives.
+    """
+    first_user, second_user = (uuid.UUID(user_id) for user_id in users.split(":"))
+    if friend_graph.ready:
+        friend_graph.add(first_user, second_user)
+    suggestion_engine.add_edge(first_user, second_user)
+
+
+shared_cache.subscribe("friendship", add_friendship)
 
 
 def reject_friend_request(db: Session, current_user: User, friend_request: Friendship | Type[Friendship]):
@@ -127,12 +242,13 @@ def reject_friend_request(db: Session, current_user: User, friend_request: Frien
     if not friend_request:
         return NotFound(key="Friend request", key_value="")
 
-    friend_request.status = FriendshipStatus.REJECTED
-    friend_request.responded = datetime.now()
-    db.commit()
-    db.refresh(friend_request)
+    if not set_friend_request_status(db, friend_request, FriendshipStatus.REJECTED):
+        return NotFound(key="Friend request", key_value="")
+
+    friend_requests_changed(friend_request.receiver_id)
 
-    return format_friend_request_response(db, friend_request)
+    return push_friend_request("rejected", format_friend_request_response(db, friend_request),
+                               friend_request.user_id, friend_request.receiver_id)
 
 
 def open_friend_request(db: Session, current_user: User, friend_request_id: uuid.UUID, action: FriendRequestAction):
@@ -161,11 +277,76 @@ def open_friend_request(db: Session, current_user: User, friend_request_id: uuid
         case FriendRequestAction.REJECT:
             return reject_friend_request(db, current_user, friend_request)
         case _:
-            friend_request.status = FriendshipStatus.SEEN
-            friend_request.responded = datetime.now()
-            db.commit()
-            db.refresh(friend_request)
-            return format_friend_request_response(db, friend_request)
+            if not set_friend_request_status(db, friend_request, FriendshipStatus.SEEN):
+                return NotFound(key="Friend request", key_value="")
+            friend_requests_changed(friend_request.receiver_id)
+            return push_friend_request("seen", format_friend_request_response(db, friend_request),
+                                       friend_request.user_id, friend_request.receiver_id)
+
+
+def respond_friend_requests(db: Session, current_user: User, friend_request_ids: List[uuid.UUID],
+                            action: FriendRequestAction):
+    """
+    Accept or reject many friend requests with an UPDATE ... RETURNING per status they can be answered from,
+    pending and seen, limited to the requests received by the current user, and update the friendship counters
+    in the same transaction. The ids it didn't update are looked up only to tell "forbidden" from "not_found".
+    Returns a result per distinct id, in the order given.
+    """
+
+    if not current_user:
+        return Unauthorized()
+
+    friend_request_ids = list(dict.fromkeys(friend_request_ids))
+    accepted = action == FriendRequestAction.ACCEPT
+    status = FriendshipStatus.ACCEPTED if accepted else FriendshipStatus.REJECTED
+
+    # RETURNING can't tell which status a request was answered from, and only pending ones leave the pending
+    # counters, so update them apart. Pending first: one marked seen in between is still caught by the second
+    updated, stats = [], StatsDelta()
+    for previous in (FriendshipStatus.PENDING, FriendshipStatus.SEEN):
+        # Columns rather than entities, committing would expire entities and reload them one by one
+        answered = db.execute(update(Friendship)
+                              .where(Friendship.id.in_(friend_request_ids),
+                                     Friendship.receiver_id == current_user.id,
+                                     Friendship.status == previous)
+                              .values(status=status, responded=datetime.now())
+                              .returning(Friendship.id, Friendship.created, Friendship.user_id,
+                                         Friendship.receiver_id, Friendship.status, Friendship.responded),
+                              execution_options={"synchronize_session": False}).all()
+        for friend_request in answered:
+            stats.transition(friend_request.user_id, friend_request.receiver_id, previous, status)
+        updated += answered
+    stats.apply(db)
+    db.commit()
+
+    results = {}
+    updated_ids = {friend_request.id for friend_request in updated}
+    left = [friend_request_id for friend_request_id in friend_request_ids if friend_request_id not in updated_ids]
+    if left:
+        receivers = dict(db.query(Friendship.id, Friendship.receiver_id).filter(Friendship.id.in_(left)).all())
+        for friend_request_id in left:
+            forbidden = friend_request_id in receivers and receivers[friend_request_id] != current_user.id
+            results[friend_request_id] = BulkFriendRequestResult(id=friend_request_id,
+                                                                 result="forbidden" if forbidden else "not_found")
+
+    if updated:
+        senders = [friend_request.user_id for friend_request in updated]
+        if accepted:
+            for sender in senders:
+                add_friendship(f"{sender}:{current_user.id}")
+                shared_cache.publish("friendship", f"{sender}:{current_user.id}")
+            friends_changed(current_user.id, *senders)
+        friend_requests_changed(current_user.id)
+
+        for friend_request, response in zip(updated, format_friend_request_responses(db, updated)):
+            push_friend_request("accepted" if accepted else "rejected", response,
+                                friend_request.user_id, current_user.id)
+            results[friend_request.id] = BulkFriendRequestResult(id=friend_request.id,
+                                                                 result="accepted" if accepted else "rejected",
+                                                                 friend_request=response)
+
+    return JSONBytes(bulk_result_list_adapter.dump_json([results[friend_request_id]
+                                                         for friend_request_id in friend_request_ids]))
 
 
 def create_friend_request(db: Session, current_user: User, receiver_id: uuid.UUID):
@@ -184,11 +365,11 @@ def create_friend_request(db: Session, current_user: User, receiver_id: uuid.UUI
     Create a friend request.
     """
 
+    pair_low_id, pair_high_id = canonical_pair(current_user.id, receiver_id)
+
     existing_friend_request = db.query(Friendship).filter(
-        or_(
-            and_(Friendship.user_id == current_user.id, Friendship.receiver_id == receiver_id),
-            and_(Friendship.user_id == receiver_id, Friendship.receiver_id == current_user.id)
-        )
+        Friendship.pair_low_id == pair_low_id,
+        Friendship.pair_high_id == pair_high_id
     ).first()
 
     if existing_friend_request:
@@ -203,13 +384,27 @@ def create_friend_request(db: Session, current_user: User, receiver_id: uuid.UUI
 
     new_friend_request = Friendship(
         user_id=current_user.id,
-        receiver_id=receiver_id
+        receiver_id=receiver_id,
+        pair_low_id=pair_low_id,
+        pair_high_id=pair_high_id
     )
     db.add(new_friend_request)
-    db.commit()
+
+    try:
+        db.flush()
+        stats = StatsDelta()
+        stats.pending(current_user.id, receiver_id)
+        stats.apply(db)
+        db.commit()
+    except IntegrityError:
+        # The other user sent a request to us at the same time
+        db.rollback()
+        return AlreadyExists("Friend request")
+
     db.refresh(new_friend_request)
+    friend_requests_changed(receiver_id)
 
-    return format_friend_request_response(db, new_friend_request)
+    return push_friend_request("created", format_friend_request_response(db, new_friend_request), receiver_id)
 
 
 def if_friends(db: Session, first_user: uuid.UUID, second_user: uuid.UUID):
@@ -218,15 +413,66 @@ def if_friends(db: Session, first_user: uuid.UUID, second_user: uuid.UUID):
     Check if two users are friends.
     """
 
+    if friend_graph.ready:
+        return friend_graph.are_friends(first_user, second_user)
+
+    pair_low_id, pair_high_id = canonical_pair(first_user, second_user)
+
     friendship = db.query(Friendship).filter(
-        or_(
-            and_(Friendship.user_id == first_user, Friendship.receiver_id == second_user),
-            and_(Friendship.user_id == second_user, Friendship.receiver_id == first_user)
-        ),
+        Friendship.pair_low_id == pair_low_id,
+        Friendship.pair_high_id == pair_high_id,
         Friendship.status == FriendshipStatus.ACCEPTED
     ).first()
 
     if not friendship:
         return False
 
-    return True
\ No newline at end of file
+    return True
+
+
+def get_friendship_edges(db: Session):
+
+    """
+    Stream the (sender, receiver) pairs of all accepted friendships.
+    """
+
+    return (db.query(Friendship.user_id, Friendship.receiver_id)
+            .filter(Friendship.status == FriendshipStatus.ACCEPTED)
+            .yield_per(50000))
+
+
+def load_friend_graph(db: Session):
+
+    """
+    Build the in-process friendship index from the accepted friendships.
+    """
+
+    friend_graph.build(get_friendship_edges(db))
+
+
+def refresh_suggestions(db: Session):
+
+    """
+    Rebuild the mutual-friend matrix if it was never built or is due for a refresh.
+    Runs in a background task of the app, never in a request.
+    """
+
+    suggestion_engine.rebuild_if_needed(lambda: get_friendship_edges(db))
+
+
+def suggest_friends(db: Session, current_user: User, limit: int):
+
+    if not current_user:
+        return Unauthorized()
+
+    """
+    Suggest active users who are not friends yet, ranked by their number of mutual friends.
+    """
+
+    suggestions = suggestion_engine.suggest(current_user.id, suggestion_engine.max_suggestions)
+    users = {user.id: user for user in get_user_loader(db).load_many(user_id for user_id, _ in suggestions)}
+
+    return JSONBytes(suggestion_list_adapter.dump_json(
+        [FriendSuggestion(user=users[user_id], mutual_friends=mutual_friends)
+         for user_id, mutual_friends in suggestions
+         if user_id in users and users[user_id].state == State.ACTIVE][:limit]))
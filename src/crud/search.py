@@ -0,0 +1,165 @@
+import threading
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Column, Float, and_, cast, func, or_
+from sqlalchemy.orm import Query, Session
+
+from src.common.pagination import decode_cursor, encode_cursor
+from src.models.user import User
+
+
+def _trigrams(value: str, padded: bool = True) -> Set[str]:
+    """
+    Split a value into lowercase trigrams.
+    Padded trigrams follow pg_trgm and are used for ranking, unpadded ones for substring candidate lookups.
+    """
+    value = value.lower()
+    if padded:
+        value = f"  {value} "
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _similarity(first: Set[str], second: Set[str]) -> float:
+    """
+    Share of common trigrams, the same measure as pg_trgm's similarity().
+    """
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class NgramIndex:
+    """
+    In-process trigram index over one column of the users table.
+    Used where pg_trgm is not available (SQLite and test runs).
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[uuid.UUID]] = defaultdict(set)
+        self._values: Dict[uuid.UUID, str] = {}
+
+    def add(self, user_id: uuid.UUID, value: str):
+        self._values[user_id] = value.lower()
+        for trigram in _trigrams(value, padded=False):
+            self._postings[trigram].add(user_id)
+
+    def search(self, value: str) -> List[Tuple[float, uuid.UUID]]:
+        """
+        Find all ids whose value contains the given value, ranked by similarity.
+        """
+        value = value.lower()
+        trigrams = _trigrams(value, padded=False)
+
+        if trigrams:
+            candidates = set.intersection(*(self._postings.get(trigram, set()) for trigram in trigrams))
+        else:
+            candidates = self._values.keys()
+
+        query_trigrams = _trigrams(value)
+        matches = [(_similarity(query_trigrams, _trigrams(self._values[user_id])), user_id)
+                   for user_id in candidates if value in self._values[user_id]]
+
+        return sorted(matches, key=lambda match: (-match[0], match[1]))
+
+
+def _ranked_cursor_filter(score, cursor: str):
+    last_score, last_id = decode_cursor(cursor, [float, uuid.UUID])
+    return or_(score < last_score, and_(score == last_score, User.id > last_id))
+
+
+class TrigramSearchBackend:
+    """
+    Substring search served by the pg_trgm GIN indexes on users.username and users.email.
+    Matches are ranked by trigram similarity and paged by (similarity, id).
+    """
+
+    def search(self, db: Session, query: Query, column: Column, value: str,
+               cursor: Optional[str], limit: int) -> Tuple[List[User], Optional[str]]:
+        # float8 so the score survives the round trip through the cursor exactly
+        score = cast(func.similarity(column, value), Float(precision=53))
+
+        query = query.filter(column.ilike(f"%{value}%"))
+        if cursor:
+            query = query.filter(_ranked_cursor_filter(score, cursor))
+
+        rows = query.add_columns(score).order_by(score.desc(), User.id).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][1], rows[-1][0].id])
+
+        return [user for user, _ in rows], next_cursor
+
+    def index_user(self, user: User):
+        pass
+
+
+class NgramSearchBackend:
+    """
+    Portable fallback for databases without pg_trgm.
+    Keeps in-process trigram indexes of usernames and emails, built on first use and updated on user creation.
+    Only the ids of a page are loaded from the database, with the visibility filters of the base query applied.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes: Optional[Dict[str, NgramIndex]] = None
+
+    def _get_indexes(self, db: Session) -> Dict[str, NgramIndex]:
+        with self._lock:
+            if self._indexes is None:
+                indexes = {"username": NgramIndex(), "email": NgramIndex()}
+                for user_id, username, email in db.query(User.id, User.username, User.email).yield_per(10000):
+                    indexes["username"].add(user_id, username)
+                    indexes["email"].add(user_id, email)
+                self._indexes = indexes
+            return self._indexes
+
+    def search(self, db: Session, query: Query, column: Column, value: str,
+               cursor: Optional[str], limit: int) -> Tuple[List[User], Optional[str]]:
+        index = self._get_indexes(db)[column.key]
+        with self._lock:
+            matches = index.search(value)
+
+        if cursor:
+            last_score, last_id = decode_cursor(cursor, [float, uuid.UUID])
+            matches = [(score, user_id) for score, user_id in matches
+                       if score < last_score or (score == last_score and user_id > last_id)]
+
+        page: List[Tuple[float, User]] = []
+        offset = 0
+        while len(page) <= limit and offset < len(matches):
+            chunk = matches[offset:offset + 2 * limit]
+            offset += len(chunk)
+
+            users = {user.id: user for user in query.filter(User.id.in_([user_id for _, user_id in chunk])).all()}
+            page.extend((score, users[user_id]) for score, user_id in chunk if user_id in users)
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor([page[-1][0], page[-1][1].id])
+
+        return [user for _, user in page], next_cursor
+
+    def index_user(self, user: User):
+        with self._lock:
+            if self._indexes is not None:
+                self._indexes["username"].add(user.id, user.username)
+                self._indexes["email"].add(user.id, user.email)
+
+
+_trigram_backend = TrigramSearchBackend()
+_ngram_backend = NgramSearchBackend()
+
+
+def get_search_backend(db: Session) -> TrigramSearchBackend | NgramSearchBackend:
+    """
+    Get the search backend for the database the session is bound to.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return _trigram_backend
+    return _ngram_backend
@@ -0,0 +1,169 @@
+"""
+Per-user friendship counters: the deltas the friends CRUD write paths apply in their own transaction, the O(1)
+read behind GET /friends/stats, and the reconciliation that recomputes them from friendships to repair drift,
+run with `python -m src.crud.stats` or every FRIENDSHIP_STATS_RECONCILE_SECONDS by the app.
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from src.common.responses import Unauthorized
+from src.core.config import settings
+from src.database.routing import read_only
+from src.models.friends import Friendship, FriendshipStats, FriendshipStatus
+from src.models.user import User
+from src.schemas.friends import FriendshipStatsResponse
+
+logger = logging.getLogger(__name__)
+
+# (friends, incoming_pending, outgoing_pending)
+Counts = Tuple[int, int, int]
+
+
+class StatsDelta:
+
+    """
+    Changes to the counters of several users, collected by a write path and applied with one statement.
+    """
+
+    def __init__(self):
+        self.changes: Dict[uuid.UUID, list] = defaultdict(lambda: [0, 0, 0])
+
+    def friendship(self, sender_id: uuid.UUID, receiver_id: uuid.UUID, count: int = 1):
+        self.changes[sender_id][0] += count
+        self.changes[receiver_id][0] += count
+
+    def pending(self, sender_id: uuid.UUID, receiver_id: uuid.UUID, count: int = 1):
+        self.changes[receiver_id][1] += count
+        self.changes[sender_id][2] += count
+
+    def transition(self, sender_id: uuid.UUID, receiver_id: uuid.UUID,
+                   previous: FriendshipStatus, status: FriendshipStatus):
+        """
+        Count a friend request going from `previous` to `status`.
+        """
+        for counted, sign in ((previous, -1), (status, 1)):
+            if counted == FriendshipStatus.ACCEPTED:
+                self.friendship(sender_id, receiver_id, sign)
+            elif counted == FriendshipStatus.PENDING:
+                self.pending(sender_id, receiver_id, sign)
+
+    def apply(self, db: Session):
+        """
+        Add the changes to the counters in the current transaction, creating the rows of users who have none.
+        Rows are written in user id order, so two transactions touching the same users lock them in the same order.
+        """
+        rows = [dict(user_id=user_id, friends=friends, incoming_pending=incoming, outgoing_pending=outgoing)
+                for user_id, (friends, incoming, outgoing) in sorted(self.changes.items())
+                if friends or incoming or outgoing]
+        if not rows:
+            return
+
+        statement = upsert(db, rows)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[FriendshipStats.user_id],
+            set_={column: getattr(FriendshipStats, column) + getattr(statement.excluded, column)
+                  for column in ("friends", "incoming_pending", "outgoing_pending")}))
+        self.changes.clear()
+
+
+def upsert(db: Session, rows: list):
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(FriendshipStats).values(rows)
+
+
+@read_only
+def view_friendship_stats(db: Session, current_user: User):
+
+    if not current_user:
+        return Unauthorized()
+
+    """
+    View the friend and pending request counts of the current user.
+    """
+
+    stats = db.get(FriendshipStats, current_user.id)
+    if stats is None:
+        return FriendshipStatsResponse(friends=0, incoming_pending=0, outgoing_pending=0)
+
+    return FriendshipStatsResponse(friends=stats.friends, incoming_pending=stats.incoming_pending,
+                                   outgoing_pending=stats.outgoing_pending)
+
+
+def count_friendships(db: Session, user_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, Counts]:
+    """
+    Recompute the counters of the given users from friendships, with a query per side of the request.
+    """
+    accepted = func.sum(case((Friendship.status == FriendshipStatus.ACCEPTED, 1), else_=0))
+    pending = func.sum(case((Friendship.status == FriendshipStatus.PENDING, 1), else_=0))
+    counted = (FriendshipStatus.ACCEPTED, FriendshipStatus.PENDING)
+    user_ids = list(user_ids)
+
+    counts = {user_id: [0, 0, 0] for user_id in user_ids}
+    for user_id, friends, outgoing in db.execute(
+            select(Friendship.user_id, accepted, pending)
+            .where(Friendship.user_id.in_(user_ids), Friendship.status.in_(counted))
+            .group_by(Friendship.user_id)):
+        counts[user_id][0] += friends
+        counts[user_id][2] += outgoing
+    for user_id, friends, incoming in db.execute(
+            select(Friendship.receiver_id, accepted, pending)
+            .where(Friendship.receiver_id.in_(user_ids), Friendship.status.in_(counted))
+            .group_by(Friendship.receiver_id)):
+        counts[user_id][0] += friends
+        counts[user_id][1] += incoming
+
+    return {user_id: tuple(user_counts) for user_id, user_counts in counts.items()}
+
+
+def reconcile_friendship_stats(db: Session, batch_size: int = None) -> int:
+    """
+    Recompute the counters of every user in batches of user ids, one transaction each, and overwrite the ones
+    that drifted. The stored counters of a batch are locked first, so a write path changing them waits for the
+    batch, or the batch for it, and its delta is never lost. Returns the number of users whose counters changed.
+    """
+    batch_size = batch_size or settings.FRIENDSHIP_STATS_RECONCILE_BATCH_SIZE
+    repaired, last_id = 0, None
+
+    while True:
+        statement = select(User.id).order_by(User.id).limit(batch_size)
+        if last_id is not None:
+            statement = statement.where(User.id > last_id)
+        user_ids = db.scalars(statement).all()
+        if not user_ids:
+            return repaired
+        last_id = user_ids[-1]
+
+        stored = {user_id: tuple(counts)
+                  for user_id, *counts in db.execute(select(FriendshipStats.user_id, FriendshipStats.friends,
+                                                            FriendshipStats.incoming_pending,
+                                                            FriendshipStats.outgoing_pending)
+                                                     .where(FriendshipStats.user_id.in_(user_ids))
+                                                     .order_by(FriendshipStats.user_id)
+                                                     .with_for_update())}
+
+        drifted = [dict(user_id=user_id, friends=friends, incoming_pending=incoming, outgoing_pending=outgoing)
+                   for user_id, (friends, incoming, outgoing) in count_friendships(db, user_ids).items()
+                   if stored.get(user_id, (0, 0, 0)) != (friends, incoming, outgoing)]
+        if drifted:
+            statement = upsert(db, drifted)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[FriendshipStats.user_id],
+                set_={column: getattr(statement.excluded, column)
+                      for column in ("friends", "incoming_pending", "outgoing_pending")}))
+        db.commit()
+        repaired += len(drifted)
+
+
+if __name__ == "__main__":
+    from src.database.session import SessionLocal
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    with SessionLocal() as session:
+        logger.info("Repaired the friendship counters of %d users", reconcile_friendship_stats(session))
@@ -0,0 +1,61 @@
+import hashlib
+import secrets
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from src.core.config import settings
+from src.models.token import RefreshToken
+from src.models.user import User, State
+
+
+def hash_refresh_token(refresh_token: str) -> str:
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_id: uuid.UUID, family_id: Optional[uuid.UUID] = None) -> str:
+    """
+    Store a new refresh token for the user, in the family of the token it replaces or in a new one, and commit.
+    Also drops the user's expired tokens.
+    """
+    refresh_token = secrets.token_urlsafe(32)
+    now = datetime.now()
+
+    db.query(RefreshToken).filter(RefreshToken.user_id == user_id, RefreshToken.expires < now).delete()
+    db.add(RefreshToken(token_hash=hash_refresh_token(refresh_token), user_id=user_id,
+                        family_id=family_id or uuid.uuid4(), created=now,
+                        expires=now + timedelta(days=settings.REFRESH_TOKEN_EXPIRATION_DAYS)))
+    db.commit()
+    return refresh_token
+
+
+def rotate_refresh_token(db: Session, refresh_token: str) -> Optional[Tuple[User, str]]:
+    """
+    Exchange a refresh token for a new one, returning the user, detached, and the new token.
+    Returns None when the token is unknown, expired, already used or its user is no longer active.
+    A token used twice was stolen or leaked, so its whole family is revoked, the tokens of the thief
+    and of the user alike.
+    """
+    stored = db.query(RefreshToken).filter(RefreshToken.token_hash == hash_refresh_token(refresh_token)).first()
+    if stored is None or stored.expires < datetime.now():
+        return None
+
+    # Only one of two concurrent refreshes with the same token may win
+    rotated = db.execute(update(RefreshToken)
+                         .where(RefreshToken.id == stored.id, RefreshToken.used.is_(None))
+                         .values(used=datetime.now())).rowcount
+    if not rotated:
+        db.query(RefreshToken).filter(RefreshToken.family_id == stored.family_id).delete()
+        db.commit()
+        return None
+
+    user = db.query(User).filter(User.id == stored.user_id, User.state == State.ACTIVE).first()
+    if user is None:
+        db.commit()
+        return None
+
+    db.expunge(user)
+    return user, issue_refresh_token(db, user.id, stored.family_id)
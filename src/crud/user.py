@@ -1,21 +1,41 @@
-from pydantic import EmailStr
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from sqlalchemy import insert, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+import csv
+import json
 import logging
 
-from typing import List, Type
+from typing import AsyncIterable, List, Optional, TextIO, Type
 import uuid
 
-from src.common.responses import AlreadyExists, NotFound, Unauthorized, BadRequest, ForbiddenAccess
-from src.core.authentication import (get_password_hash, get_current_user, verify_password, authenticate_user, create_access_token)
-
+from src.common.pagination import DEFAULT_PAGE_SIZE, paginate
+from src.common.streaming import InvalidEncoding, spool_text
+from src.crud.search import get_search_backend
+from src.common.responses import AlreadyExists, NotFound, Unauthorized, BadRequest, ForbiddenAccess, ServiceUnavailable, JSONBytes
+from src.core.authentication import (get_password_hash, get_current_user, verify_password, authenticate_user, create_access_token,
+                                     revoke_claims)
+from src.core.cache import shared_cache
+from src.core.config import settings
+from src.core.security import HashingPoolSaturated, hash_password, hash_passwords
+from src.core.versions import friend_requests_changed, friends_changed, profile_changed, profile_versions
+from src.database.session import run_db
+from src.database.routing import read_only, reads_replica
+
+from src.models.friends import Friendship, FriendshipStatus
 from src.models.user import User, Role, State, StateAction, ProfileType
 from src.models.search import SearchType
 
-from src.schemas.user import (CreateUserRequest, LoginRequest, UserResponse, UpdateEmailRequest)
+from src.schemas.page import Page
+from src.schemas.user import (CreateUserRequest, LoginRequest, UserResponse, UpdateEmailRequest,
+                              BulkImportError, BulkImportResponse, UserBatchItem)
 
 
 logger = logging.getLogger(__name__)
 
+user_page_adapter = TypeAdapter(Page[UserResponse])
+user_batch_adapter = TypeAdapter(List[UserBatchItem])
+
 
 def is_admin(user: User):
     """
@@ -58,16 +78,7 @@ def username_exists(db: Session, username: str):
 
 
 def format_user_response(user: User | Type[User]):
-    return UserResponse(
-        id=user.id,
-        firstname=user.firstname,
-        lastname=user.lastname,
-        username=user.username,
-        email=user.email,
-        role=user.role,
-        state=user.state,
-        type=user.type
-    )
+    return UserResponse.model_validate(user)
 
 
 def change_state(db: Session, current_user: User , user_id: uuid.UUID, action: StateAction):
@@ -92,13 +103,33 @@ def change_state(db: Session, current_user: User , user_id: uuid.UUID, action: S
 
     db.commit()
     db.refresh(user)
+    revoke_claims(user.id)
+    user_changed(db, user.id)
 
     return format_user_response(user)
 
 
-def create_user(db: Session, user: CreateUserRequest):
+def user_changed(db: Session, user_id: uuid.UUID):
     """
-    Create a new user.
+    Retire the cached profile of a user, and the ETags of the lists that show it: the friend lists of its friends,
+    and the received friend requests of the users it has pending requests with, its own included.
+    Must be called after every committed change to a user.
+    """
+    friendships = db.query(Friendship.user_id, Friendship.receiver_id, Friendship.status).filter(
+        or_(Friendship.user_id == user_id, Friendship.receiver_id == user_id),
+        Friendship.status.in_([FriendshipStatus.ACCEPTED, FriendshipStatus.PENDING])
+    ).all()
+
+    profile_changed(user_id)
+    friends_changed(*{receiver_id if sender_id == user_id else sender_id
+                      for sender_id, receiver_id, status in friendships if status == FriendshipStatus.ACCEPTED})
+    friend_requests_changed(user_id, *{receiver_id for sender_id, receiver_id, status in friendships
+                                       if status == FriendshipStatus.PENDING and sender_id == user_id})
+
+
+def user_conflict(db: Session, user: CreateUserRequest):
+    """
+    Check that the username and email of a new user are not taken.
     """
     if username_exists(db, user.username):
         return AlreadyExists(content="Username")
@@ -106,21 +137,218 @@ def create_user(db: Session, user: CreateUserRequest):
     if email_exists(db, user.email):
         return AlreadyExists(content="User")
 
+    return None
+
+
+def insert_user(db: Session, user: CreateUserRequest, password_hash: str):
+    """
+    Insert a new user with an already hashed password.
+    """
     db_user = User(
         firstname=user.firstname,
         lastname=user.lastname,
         username=user.username,
         email=str(user.email),
-        password=get_password_hash(user.password),
+        password=password_hash,
     )
 
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
 
+    get_search_backend(db).index_user(db_user)
+
     return format_user_response(db_user)
 
 
+async def create_user(db: Session, user: CreateUserRequest):
+    """
+    Create a new user.
+    The password is hashed in the hashing pool between the uniqueness checks and the insert.
+    """
+    conflict = await run_db(db, user_conflict, user)
+    if conflict:
+        return conflict
+
+    try:
+        password_hash = await hash_password(user.password)
+    except HashingPoolSaturated:
+        return ServiceUnavailable()
+
+    return await run_db(db, insert_user, user, password_hash)
+
+
+def taken_usernames_and_emails(db: Session, usernames: List[str], emails: List[str]):
+    """
+    Find which of the given usernames and emails already exist, with one query.
+    """
+    rows = db.query(User.username, User.email).filter(or_(User.username.in_(usernames), User.email.in_(emails))).all()
+    return {row.username for row in rows}, {row.email for row in rows}
+
+
+def insert_users(db: Session, rows: List[dict]):
+    """
+    Insert a batch of users with one multi-row INSERT.
+    Returns the number of users created, or None if the batch hit a unique constraint and nothing was inserted.
+    """
+    try:
+        created = db.execute(insert(User).returning(User.id, User.username, User.email), rows).all()
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+
+    search_backend = get_search_backend(db)
+    for user in created:
+        search_backend.index_user(user)
+
+    return len(created)
+
+
+def insert_users_one_by_one(db: Session, rows: List[dict]):
+    """
+    Insert a batch of users row by row, to find out which ones conflict with concurrent registrations.
+    Returns the indexes of the rows that could not be inserted.
+    """
+    failed = []
+    for index, row in enumerate(rows):
+        if insert_users(db, [row]) is None:
+            failed.append(index)
+    return failed
+
+
+def _parse_import_rows(upload: TextIO, file_format: str):
+    """
+    Yield (line number, parsed fields or error) for every record of an NDJSON or CSV import, skipping blank lines.
+    CSV records are numbered by their first line, a quoted field may span lines.
+    """
+    if file_format == "csv":
+        reader = csv.reader(upload)
+        header = None
+        while True:
+            line_number = reader.line_num + 1
+            try:
+                values = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as error:
+                yield line_number, f"Invalid CSV: {error}"
+                continue
+            if not any(value.strip() for value in values):
+                continue
+            if header is None:
+                header = [value.strip().lower() for value in values]
+                continue
+            yield line_number, dict(zip(header, values))
+
+    for line_number, line in enumerate(upload, 1):
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+        except json.JSONDecodeError:
+            yield line_number, "Invalid JSON"
+            continue
+        yield line_number, fields if isinstance(fields, dict) else "Expected a JSON object"
+
+
+async def _import_batch(db: Session, batch: List[tuple[int, CreateUserRequest]], report: BulkImportResponse,
+                        seen_usernames: set, seen_emails: set):
+    taken_usernames, taken_emails = await run_db(db, taken_usernames_and_emails,
+                                                 [user.username for _, user in batch],
+                                                 [str(user.email) for _, user in batch])
+
+    accepted = []
+    for row_number, user in batch:
+        errors = []
+        if user.username in taken_usernames or user.username in seen_usernames:
+            errors.append("Username already exists")
+        if str(user.email) in taken_emails or str(user.email) in seen_emails:
+            errors.append("User already exists")
+
+        if errors:
+            report.errors.append(BulkImportError(row=row_number, errors=errors))
+            continue
+
+        seen_usernames.add(user.username)
+        seen_emails.add(str(user.email))
+        accepted.append((row_number, user))
+
+    if not accepted:
+        return
+
+    password_hashes = await hash_passwords([user.password for _, user in accepted])
+    rows = [dict(firstname=user.firstname, lastname=user.lastname, username=user.username,
+                 email=str(user.email), password=password_hash)
+            for (_, user), password_hash in zip(accepted, password_hashes)]
+
+    created = await run_db(db, insert_users, rows)
+    if created is None:
+        failed = await run_db(db, insert_users_one_by_one, rows)
+        for index in failed:
+            report.errors.append(BulkImportError(row=accepted[index][0], errors=["User already exists"]))
+        created = len(rows) - len(failed)
+
+    report.created += created
+
+
+async def import_users(db: Session, current_user: User, chunks: AsyncIterable[bytes], file_format: str):
+    """
+    Import users from an NDJSON or CSV upload.
+    The upload is spooled to a temporary file first, and rejected as a whole when it is not valid UTF-8.
+    Rows are validated like single registrations, then handled in batches: one uniqueness query, passwords
+    hashed across the hashing pool, and one multi-row insert per batch. Invalid or duplicate rows are reported
+    by line number and do not stop the import.
+    """
+    if not current_user:
+        return Unauthorized()
+
+    if not is_admin(current_user):
+        return ForbiddenAccess()
+
+    try:
+        upload = await spool_text(chunks)
+    except InvalidEncoding as error:
+        return BadRequest(f"Nothing was imported: the upload is not valid UTF-8, "
+                          f"the first invalid byte is at offset {error.offset}.")
+
+    with upload:
+        return await _import_upload(db, upload, file_format)
+
+
+async def _import_upload(db: Session, upload: TextIO, file_format: str) -> BulkImportResponse:
+    """
+    Import the records of a spooled upload and report the ones rejected.
+    """
+    report = BulkImportResponse(created=0, failed=0, errors=[])
+    seen_usernames, seen_emails = set(), set()
+    batch: List[tuple[int, CreateUserRequest]] = []
+
+    for row_number, fields in _parse_import_rows(upload, file_format):
+        if isinstance(fields, str):
+            report.errors.append(BulkImportError(row=row_number, errors=[fields]))
+            continue
+
+        try:
+            batch.append((row_number, CreateUserRequest(**fields)))
+        except ValidationError as error:
+            report.errors.append(BulkImportError(
+                row=row_number,
+                errors=[f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors()]))
+            continue
+
+        if len(batch) >= settings.BULK_IMPORT_BATCH_SIZE:
+            await _import_batch(db, batch, report, seen_usernames, seen_emails)
+            batch = []
+
+    if batch:
+        await _import_batch(db, batch, report, seen_usernames, seen_emails)
+
+    report.errors.sort(key=lambda error: error.row)
+    report.failed = len(report.errors)
+    return report
+
+
 def get_me(current_user: User):
     """
     Get user data.
@@ -135,15 +363,103 @@ def get_user_by_id(db: Session, user_id: uuid.UUID):
     """
     Get a user by user_id.
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        return NotFound(key="User", key_value="")
-    return format_user_response(user)
+    return get_user_loader(db).load(user_id)
 
-def search_user(db: Session, current_user: User, search_type: SearchType, search_value: str):
+@read_only
+def get_users_by_ids(db: Session, current_user: User, user_ids: List[uuid.UUID]):
+    """
+    Get many users by id, with one shared cache lookup and one query for the ones not cached.
+    Returns an item per id, in the order given, whose user is null for unknown ids. Like search_user,
+    only admins and moderators see users that aren't active, for the others they are null too.
+    """
+    if not current_user:
+        return Unauthorized()
+
+    if len(user_ids) > settings.USER_BATCH_MAX_IDS:
+        return BadRequest(f"At most {settings.USER_BATCH_MAX_IDS} ids can be looked up at once.")
+
+    filter_active = not (is_admin(current_user) or is_moderator(current_user))
+    users = {user.id: user for user in get_user_loader(db).load_many(set(user_ids))
+             if not filter_active or user.state == State.ACTIVE}
+
+    return JSONBytes(user_batch_adapter.dump_json([UserBatchItem(id=user_id, user=users.get(user_id))
+                                                   for user_id in user_ids]))
+
+
+def user_cache_key(user_id: uuid.UUID, version: str) -> str:
+    return f"user:{user_id}:{version}"
+
+
+class UserLoader:
+    """
+    Request-scoped batch loader for users.
+    Collects user ids and resolves all of them with one shared cache lookup and a single IN query
+    for the ones not cached, instead of one query per id.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._users: dict[uuid.UUID, UserResponse] = {}
+
+    def load_many(self, user_ids) -> List[UserResponse]:
+        """
+        Resolve the given user ids, querying only the ones not loaded yet.
+        Unknown ids are skipped.
+        """
+        user_ids = list(user_ids)
+        missing = {user_id for user_id in user_ids if user_id not in self._users}
+
+        if missing:
+            missing = list(missing)
+            # Taken before the query, see src/core/versions.py
+            keys = dict(zip(missing, (user_cache_key(user_id, version)
+                                      for user_id, version in zip(missing, profile_versions(missing)))))
+            for user_id, cached in zip(missing, shared_cache.get_many(list(keys.values()))):
+                if cached is not None:
+                    self._users[user_id] = UserResponse.model_validate_json(cached)
+
+            missing = [user_id for user_id in missing if user_id not in self._users]
+
+        if missing:
+            loaded = [format_user_response(user) for user in self.db.query(User).filter(User.id.in_(missing)).all()]
+            for user in loaded:
+                self._users[user.id] = user
+            # A lagging replica would put old profiles in the cache, where the next ETag'd reads would find them
+            if not reads_replica(self.db):
+                shared_cache.set_many({keys[user.id]: user.model_dump_json().encode() for user in loaded},
+                                      ttl=settings.CACHE_TTL)
+
+        return [self._users[user_id] for user_id in user_ids if user_id in self._users]
+
+    def load(self, user_id: uuid.UUID):
+        """
+        Resolve a single user id, using the already loaded users when possible.
+        """
+        if user_id not in self._users:
+            self.load_many([user_id])
+
+        user = self._users.get(user_id)
+        if not user:
+            return NotFound(key="User", key_value="")
+        return user
+
+
+def get_user_loader(db: Session) -> UserLoader:
+    """
+    Get the user loader bound to the session, so it lives as long as the request.
+    """
+    if "user_loader" not in db.info:
+        db.info["user_loader"] = UserLoader(db)
+    return db.info["user_loader"]
+
+@read_only
+def search_user(db: Session, current_user: User, search_type: SearchType, search_value: str,
+                cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
     """
     Search for users by role, username, or email. Lists all users if no search type or value is provided.
     Admins and moderators can view all users, others can only see active users.
+    Username and email searches are substring matches ranked by similarity, other listings are ordered by username.
+    Pass the returned next_cursor to get the next page.
     """
     if not current_user:
         return Unauthorized()
@@ -159,22 +475,26 @@ def search_user(db: Session, current_user: User, search_type: SearchType, search
     if filter_active:
         query = query.filter(User.state == State.ACTIVE)
 
-    # Apply search filters
-    if search_type == SearchType.ROLE:
-        query = query.filter(User.role == search_value.upper())
-    elif search_type == SearchType.USERNAME:
-        query = query.filter(User.username.ilike(f"%{search_value}%"))
-    elif search_type == SearchType.EMAIL:
-        query = query.filter(User.email.ilike(f"%{search_value}%"))
-
-    # Execute the query
-    users = query.all() if not search_type else [query.first()]
-
-    if not users or users == [None]:
+    # Apply search filters and execute the query for a single page
+    try:
+        if search_type == SearchType.USERNAME:
+            users, next_cursor = get_search_backend(db).search(db, query, User.username, search_value, cursor, limit)
+        elif search_type == SearchType.EMAIL:
+            users, next_cursor = get_search_backend(db).search(db, query, User.email, search_value, cursor, limit)
+        else:
+            if search_type == SearchType.ROLE:
+                query = query.filter(User.role == search_value.upper())
+            users, next_cursor = paginate(query, (User.username, User.id), cursor, limit)
+    except ValueError:
+        return BadRequest("Invalid cursor.")
+
+    if not users and not cursor:
         key = "User" if search_type else "Users"
         return NotFound(key=key, key_value=search_value)
 
-    return [format_user_response(user) for user in users] if isinstance(users, list) else format_user_response(users[0])
+    # Validate straight from the ORM rows and encode to bytes, skipping the per-field encoding FastAPI would do
+    return JSONBytes(user_page_adapter.dump_json(Page[UserResponse].model_validate(
+        {"items": users, "next_cursor": next_cursor}, from_attributes=True)))
 
 def change_type(db: Session, current_user: User, action: ProfileType):
 
@@ -194,5 +514,7 @@ def change_type(db: Session, current_user: User, action: ProfileType):
 
     db.commit()
     db.refresh(user)
+    revoke_claims(user.id)
+    user_changed(db, user.id)
 
     return format_user_response(user)
\ No newline at end of file
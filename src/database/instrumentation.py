@@ -0,0 +1,183 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+from sqlalchemy import Engine, event
+from sqlalchemy.pool import Pool
+
+from src.core.config import settings
+from src.core.metrics import Collected, pool_checkout_wait, registry
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    SQL statements executed, and the time spent executing them, while serving one request.
+    Statements also count towards the stats of the enclosing block when tracking is nested.
+    """
+
+    __slots__ = ("statements", "duration", "parent")
+
+    def __init__(self, parent: Optional["QueryStats"] = None):
+        self.statements = 0
+        self.duration = 0.0
+        self.parent = parent
+
+
+# Stats of the request being served. The threadpool and the greenlets of AsyncSession.run_sync
+# run with a copy of the request context, so they all add to the same object.
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """
+    Count the statements executed inside the block, on any instrumented engine.
+    """
+    stats = QueryStats(parent=_query_stats.get())
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+class CapturedQueries:
+    """
+    Statements recorded by capture_queries, in execution order.
+    """
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def __iter__(self):
+        return iter(self.statements)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised by query_budget when a block executes more statements than allowed.
+    """
+
+
+_captures: List[CapturedQueries] = []
+_captures_lock = threading.Lock()
+
+
+@contextmanager
+def capture_queries() -> Iterator[CapturedQueries]:
+    """
+    Record every statement executed on an instrumented engine while the block runs, from any thread or task.
+    Unlike track_queries it doesn't depend on the context, so it also sees the requests of a TestClient,
+    which runs the app in its own thread. Meant for tests and budget checks, not for serving requests.
+    """
+    captured = CapturedQueries()
+    with _captures_lock:
+        _captures.append(captured)
+    try:
+        yield captured
+    finally:
+        with _captures_lock:
+            _captures.remove(captured)
+
+
+@contextmanager
+def query_budget(max_statements: int, label: str = "block") -> Iterator[CapturedQueries]:
+    """
+    Fail with QueryBudgetExceeded, listing the statements, when the block executes more than max_statements.
+    """
+    with capture_queries() as captured:
+        yield captured
+
+    if len(captured) > max_statements:
+        listing = "\n".join(f"  {i}. {' '.join(statement.split())}" for i, statement in enumerate(captured, 1))
+        raise QueryBudgetExceeded(f"{label} executed {len(captured)} statements, "
+                                  f"the budget is {max_statements}:\n{listing}")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    if settings.SQL_ECHO_SAMPLE_RATE and random.random() < settings.SQL_ECHO_SAMPLE_RATE:
+        logger.info("%s %r", statement, parameters)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+
+    stats = _query_stats.get()
+    while stats is not None:
+        stats.statements += 1
+        stats.duration += duration
+        stats = stats.parent
+
+    if _captures:
+        with _captures_lock:
+            for captured in _captures:
+                captured.statements.append(statement)
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't run for a failed statement, drop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def _time_checkouts(pool: Pool, name: str):
+    """
+    Measure how long connections take to come out of the pool, waiting included.
+    Pools have no event before a checkout, so this wraps Pool.connect on the instance.
+    """
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - start, name)
+
+    pool.connect = timed_connect
+
+
+_engines: dict[str, Engine] = {}
+
+
+def instrument_engine(engine: Engine, name: str):
+    """
+    Count and time the statements of an engine and expose its pool in /metrics.
+    Pass `async_engine.sync_engine` for an AsyncEngine.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+    _time_checkouts(engine.pool, name)
+    # Engine.dispose replaces the pool with a new one
+    event.listen(engine, "engine_disposed", lambda disposed: _time_checkouts(disposed.pool, name))
+
+    _engines[name] = engine
+
+
+def _pool_samples(attribute: str):
+    for name, engine in _engines.items():
+        # Only queue pools have a size, SQLite's in-memory and NullPool don't
+        value = getattr(engine.pool, attribute, None)
+        if callable(value):
+            yield {"engine": name}, value()
+
+
+registry.register(Collected("db_pool_connections_in_use", "Connections checked out of the pool.", "gauge",
+                            lambda: _pool_samples("checkedout")))
+registry.register(Collected("db_pool_size", "Connections the pool keeps open.", "gauge",
+                            lambda: _pool_samples("size")))
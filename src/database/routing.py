@@ -0,0 +1,130 @@
+import functools
+import itertools
+import logging
+import threading
+from typing import Callable, List, Optional
+
+from sqlalchemy import Engine, event, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaSet:
+    """
+    Read replicas handed out round-robin. A replica is skipped from the moment it loses its connection
+    or fails a health check until it passes a health check again.
+    """
+
+    def __init__(self, engines: List[Engine | AsyncEngine]):
+        self.engines = engines
+        self._healthy = {id(engine): True for engine in engines}
+        self._next = itertools.cycle(range(len(engines))) if engines else None
+        self._lock = threading.Lock()
+
+        for engine in engines:
+            event.listen(self._bind(engine), "handle_error", functools.partial(self._on_error, engine))
+
+    @staticmethod
+    def _bind(engine: Engine | AsyncEngine) -> Engine:
+        return engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+
+    def _on_error(self, engine: Engine | AsyncEngine, exception_context):
+        if exception_context.is_disconnect or exception_context.connection is None:
+            self.mark(engine, healthy=False)
+
+    def mark(self, engine: Engine | AsyncEngine, healthy: bool):
+        if self._healthy[id(engine)] != healthy:
+            logger.warning("Replica %s is %s", engine.url.render_as_string(hide_password=True),
+                           "back" if healthy else "down, reads go to the primary")
+        self._healthy[id(engine)] = healthy
+
+    def choose(self) -> Optional[Engine]:
+        """
+        The next healthy replica, or None to use the primary.
+        """
+        if self._next is None:
+            return None
+
+        with self._lock:
+            for _ in range(len(self.engines)):
+                engine = self.engines[next(self._next)]
+                if self._healthy[id(engine)]:
+                    return self._bind(engine)
+        return None
+
+    async def check(self):
+        """
+        Run SELECT 1 on every replica and update their health.
+        """
+        for engine in self.engines:
+            try:
+                if isinstance(engine, AsyncEngine):
+                    async with engine.connect() as connection:
+                        await connection.execute(text("SELECT 1"))
+                else:
+                    await run_in_threadpool(self._ping, engine)
+            except Exception:
+                self.mark(engine, healthy=False)
+            else:
+                self.mark(engine, healthy=True)
+
+    @staticmethod
+    def _ping(engine: Engine):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+
+class RoutingSession(Session):
+    """
+    Session that sends the queries of read_only CRUD functions to a replica.
+    Everything else, and every query after the session has written anything, goes to the primary,
+    so a request always reads its own writes.
+    """
+
+    def __init__(self, *args, replicas: Optional[ReplicaSet] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas or ReplicaSet([])
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.info.get("read_only") and not self.info.get("wrote") and not self._flushing:
+            replica = self.replicas.choose()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _stick_to_primary(session: Session, flush_context):
+    session.info["wrote"] = True
+
+
+def reads_replica(db: Session) -> bool:
+    """
+    Whether the queries of the session may go to a replica, so their results must not be cached for other requests.
+    """
+    return bool(db.info.get("read_only") and not db.info.get("wrote") and getattr(db, "replicas", None)
+                and db.replicas.engines)
+
+
+def read_only(fn: Callable) -> Callable:
+    """
+    Let a CRUD function read from a replica. Its session is the first argument.
+    Only for functions that never write and can live with the replication lag. Not for the ones behind an ETag,
+    which comes from the version counters and is always current: a lagging replica would serve the old body under
+    the new tag, and every If-None-Match after it would keep the client on that body. Nor for the ones that fill
+    the shared cache.
+    """
+    @functools.wraps(fn)
+    def wrapper(db: Session, *args, **kwargs):
+        previous = db.info.get("read_only", False)
+        db.info["read_only"] = True
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.info["read_only"] = previous
+
+    return wrapper
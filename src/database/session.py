@@ -1,19 +1,101 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from pathlib import Path
+from typing import Any, Callable
 
-from src.core.config import settings
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import Connection, create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from src.core.config import settings, to_async_url
+from src.database.instrumentation import instrument_engine
+from src.database.routing import ReplicaSet, RoutingSession
 from src.models.base import Base
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    echo=True,
+engine = create_engine(settings.DATABASE_URL)
+instrument_engine(engine, "sync")
+
+replicas = ReplicaSet([create_engine(url) for url in settings.DATABASE_REPLICA_URLS])
+for number, replica in enumerate(replicas.engines):
+    instrument_engine(replica, f"sync_replica_{number}")
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession, replicas=replicas)
+
+async_engine = (
+    create_async_engine(settings.ASYNC_DATABASE_URL)
+    if settings.DATABASE_ASYNC
+    else None
+)
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine, "async")
+
+async_replicas = ReplicaSet([create_async_engine(to_async_url(url)) for url in settings.DATABASE_REPLICA_URLS]
+                            if settings.DATABASE_ASYNC else [])
+for number, replica in enumerate(async_replicas.engines):
+    instrument_engine(replica.sync_engine, f"async_replica_{number}")
+
+AsyncSessionLocal = (
+    async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False,
+                       sync_session_class=RoutingSession, replicas=async_replicas)
+    if async_engine is not None
+    else None
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+ALEMBIC_CONFIG = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+
+def verify_schema(connection: Connection):
+    """
+    Check that the database is at the latest migration.
+    """
+    current = MigrationContext.configure(connection).get_current_revision()
+    head = ScriptDirectory.from_config(Config(str(ALEMBIC_CONFIG))).get_current_head()
+
+    if current != head:
+        raise RuntimeError(f"Database schema is at revision {current}, expected {head}. "
+                           f"Run `alembic upgrade head` before starting the app.")
+
+
+def prepare_schema(connection: Connection):
+    if settings.DATABASE_STARTUP == "create":
+        Base.metadata.create_all(bind=connection)
+    else:
+        verify_schema(connection)
+
+
+async def init_db():
+    """
+    Verify the database schema revision, or create all tables when DATABASE_STARTUP is "create".
+    """
+    if async_engine is not None:
+        async with async_engine.begin() as connection:
+            await connection.run_sync(prepare_schema)
+    else:
+        with engine.begin() as connection:
+            prepare_schema(connection)
+
+
+async def run_db(db: Session | AsyncSession, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a sync CRUD function with the request session as its first argument without blocking the event loop.
+    With an AsyncSession the function runs on the async connection through SQLAlchemy's greenlet bridge,
+    otherwise it runs in the threadpool the same way a plain `def` endpoint would.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
 
 
-def init_db():
+async def run_in_session(fn: Callable[..., Any], *args, **kwargs) -> Any:
     """
-    Create all tables in the database.
+    Run a sync CRUD function in a new session outside of a request, e.g. at startup or in a background job.
+    It always uses the blocking engine in the threadpool, so a long job never holds the event loop.
     """
-    Base.metadata.create_all(bind=engine)
+    def run():
+        with SessionLocal() as db:
+            return fn(db, *args, **kwargs)
+
+    return await run_in_threadpool(run)
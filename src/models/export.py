@@ -0,0 +1,10 @@
+from enum import Enum as PyEnum
+
+
+class ExportFormat(PyEnum):
+
+    """
+    Enum representing export file formats.
+    """
+    NDJSON = "ndjson"
+    CSV = "csv"
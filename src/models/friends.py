@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, UniqueConstraint, DateTime
+from sqlalchemy import Column, String, UniqueConstraint, DateTime, Index, Integer
 from src.models.base import Base
 import uuid
 from enum import Enum as PyEnum
@@ -32,6 +32,14 @@ class FriendshipStatus(PyEnum):
     REJECTED = "rejected"
 
 
+def canonical_pair(first_user: uuid.UUID, second_user: uuid.UUID) -> tuple[uuid.UUID, uuid.UUID]:
+
+    """
+    Order two user ids the same way regardless of who sent the request.
+    """
+    return (first_user, second_user) if first_user < second_user else (second_user, first_user)
+
+
 class Friendship(Base):
 
     """
@@ -42,12 +50,37 @@ class Friendship(Base):
     __tablename__ = "friendships"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
-    created = Column(DateTime, default=datetime.now(), nullable=False)
+    created = Column(DateTime, default=datetime.now, nullable=False)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     receiver_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    # canonical_pair(user_id, receiver_id), one row per pair of users whatever the direction
+    pair_low_id = Column(UUID(as_uuid=True), nullable=False)
+    pair_high_id = Column(UUID(as_uuid=True), nullable=False)
     status = Column(Enum(FriendshipStatus, name="friendship_status_enum"), default=FriendshipStatus.PENDING)
     responded = Column(DateTime, default=None, nullable=True)
 
     __table_args__ = (
-        UniqueConstraint("user_id", "receiver_id", name="unique_friendship"),
-    )
\ No newline at end of file
+        UniqueConstraint("pair_low_id", "pair_high_id", name="unique_friendship_pair"),
+        # Friend lists, the pending requests inbox and loading all accepted friendships
+        Index("ix_friendships_status", "status"),
+        Index("ix_friendships_user_id_status", "user_id", "status"),
+        Index("ix_friendships_receiver_id_status", "receiver_id", "status"),
+        # Keyset pagination of the friendships log
+        Index("ix_friendships_created_id", "created", "id"),
+    )
+
+class FriendshipStats(Base):
+
+    """
+    Database model representing "friendship_stats" table in the database.
+    Friend and pending request counts of a user, kept up to date by the friends CRUD write paths in the
+    transaction of the change, so they can be shown without loading the lists. A user without a row has none.
+    Pending counts only requests still in PENDING, like GET /friends/requests, marking one seen takes it off.
+    """
+
+    __tablename__ = "friendship_stats"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True, nullable=False)
+    friends = Column(Integer, default=0, nullable=False)
+    incoming_pending = Column(Integer, default=0, nullable=False)
+    outgoing_pending = Column(Integer, default=0, nullable=False)
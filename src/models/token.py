@@ -0,0 +1,29 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Index, String
+from sqlalchemy.dialects.postgresql import UUID
+from src.models.base import Base
+import uuid
+from datetime import datetime
+
+
+class RefreshToken(Base):
+
+    """
+    Database model representing "refresh_tokens" table in the database.
+    Only a SHA-256 of the token is stored. Each refresh rotates the token: the old one is marked used and
+    a new one joins its family, the tokens descending from the same login.
+    """
+
+    __tablename__ = "refresh_tokens"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    token_hash = Column(String(64), unique=True, nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    family_id = Column(UUID(as_uuid=True), nullable=False)
+    created = Column(DateTime, default=datetime.now, nullable=False)
+    expires = Column(DateTime, nullable=False)
+    used = Column(DateTime, default=None, nullable=True)
+
+    __table_args__ = (
+        Index("ix_refresh_tokens_user_id", "user_id"),
+        Index("ix_refresh_tokens_family_id", "family_id"),
+    )
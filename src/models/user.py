@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String
+from sqlalchemy import Column, DDL, String, event
 from src.models.base import Base
 import uuid
 from enum import Enum as PyEnum
@@ -7,6 +7,7 @@ from sqlalchemy import (
     Column,
     Enum,
     ForeignKey,
+    Index,
     String,
 )
 
@@ -67,3 +68,22 @@ class User(Base):
     role = Column(Enum(Role, name="role_enum"), default=Role.USER)
     state = Column(Enum(State, name="state_enum"), default=State.ACTIVE)
     type = Column(Enum(ProfileType, name="type_enum"), default=ProfileType.PUBLIC)
+
+    __table_args__ = (
+        # Keyset pagination of the users directory, for everyone and for active-only listings
+        Index("ix_users_username_id", "username", "id"),
+        Index("ix_users_state_username_id", "state", "username", "id"),
+        Index("ix_users_role", "role"),
+        # Substring search of usernames and emails (pg_trgm)
+        Index("ix_users_username_trgm", "username",
+              postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_users_email_trgm", "email",
+              postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+event.listen(
+    User.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
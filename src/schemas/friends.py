@@ -2,9 +2,9 @@ import uuid
 
 from pydantic import BaseModel, Field, field_validator, EmailStr
 from src.models.user import Role
-from typing import Optional
+from typing import List, Literal, Optional
 import re
-from src.models.friends import FriendshipStatus
+from src.models.friends import FriendRequestAction, FriendshipStatus
 from src.schemas.user import UserResponse
 from datetime import datetime
 
@@ -28,4 +28,47 @@ class FriendRequestResponse(BaseModel):
     sender: UserResponse = Field()
     receiver: UserResponse = Field()
     status: FriendshipStatus = Field()
-    responded: Optional[str] = Field()
\ No newline at end of file
+    responded: Optional[str] = Field()
+
+
+class FriendSuggestion(BaseModel):
+
+    """
+    Schema for a suggested friend.
+    """
+
+    user: UserResponse = Field()
+    mutual_friends: int = Field(examples=[3])
+
+
+class BulkFriendRequestUpdate(BaseModel):
+
+    """
+    Schema for accepting or rejecting several friend requests at once.
+    """
+
+    ids: List[uuid.UUID] = Field(min_length=1, max_length=500, examples=[["123e4567-e89b-12d3-a456-426614174000"]])
+    action: FriendRequestAction = Field(examples=["accept"])
+
+
+class BulkFriendRequestResult(BaseModel):
+
+    """
+    Schema for the outcome of one friend request of a bulk update.
+    "not_found" also covers requests that were already accepted or rejected.
+    """
+
+    id: uuid.UUID = Field(examples=["123e4567-e89b-12d3-a456-426614174000"])
+    result: Literal["accepted", "rejected", "not_found", "forbidden"] = Field()
+    friend_request: Optional[FriendRequestResponse] = Field(default=None)
+
+
+class FriendshipStatsResponse(BaseModel):
+
+    """
+    Schema for the friend and pending friend request counts of a user.
+    """
+
+    friends: int = Field(examples=[42])
+    incoming_pending: int = Field(examples=[3])
+    outgoing_pending: int = Field(examples=[1])
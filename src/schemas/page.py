@@ -0,0 +1,16 @@
+from pydantic import BaseModel, Field
+from typing import Generic, List, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+
+    """
+    Schema for a page of results.
+    Pass next_cursor back as the cursor parameter to get the next page; it is null on the last page.
+    """
+
+    items: List[T] = Field()
+    next_cursor: Optional[str] = Field(default=None)
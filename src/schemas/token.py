@@ -1,11 +1,32 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from typing import Optional
 from uuid import UUID
 
+from src.models.user import Role, State, ProfileType
+
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    # Seconds the access token is valid for, and the token that gets the next one from POST /token/refresh
+    expires_in: Optional[int] = None
+    refresh_token: Optional[str] = None
 
 
 class TokenData(BaseModel):
     user_identifier: UUID | None = None
+
+
+class Principal(BaseModel):
+
+    """
+    The user behind an access token, as described by its claims.
+    Has the attributes the role checks and most CRUD functions need from a User, without loading it.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    id: UUID
+    role: Role
+    state: State
+    type: ProfileType
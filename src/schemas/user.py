@@ -1,8 +1,8 @@
 import uuid
 
-from pydantic import BaseModel, Field, field_validator, EmailStr
+from pydantic import BaseModel, ConfigDict, Field, field_validator, EmailStr
 from src.models.user import Role, State, ProfileType
-from typing import Optional
+from typing import List, Optional
 import re
 
 
@@ -101,6 +101,8 @@ class UserResponse(BaseModel):
     Schema for returning user data.
     """
 
+    model_config = ConfigDict(from_attributes=True)
+
     id: uuid.UUID
     firstname: str
     lastname: str
@@ -109,3 +111,34 @@ class UserResponse(BaseModel):
     role: Role
     state: State
     type: ProfileType
+
+
+class BulkImportError(BaseModel):
+
+    """
+    Schema for a row rejected by a bulk import.
+    """
+
+    row: int = Field(examples=[2])
+    errors: List[str] = Field(examples=[["Username already exists"]])
+
+
+class UserBatchItem(BaseModel):
+
+    """
+    Schema for one id of a batch lookup, the user is null when it doesn't exist or isn't visible.
+    """
+
+    id: uuid.UUID
+    user: Optional[UserResponse] = None
+
+
+class BulkImportResponse(BaseModel):
+
+    """
+    Schema for the result of a bulk import.
+    """
+
+    created: int = Field(examples=[998])
+    failed: int = Field(examples=[2])
+    errors: List[BulkImportError] = Field()
@@ -0,0 +1,144 @@
+"""
+Fixtures of the test suite: the app behind a TestClient on a throwaway SQLite database, worlds of users and
+friendships seeded in growing sizes, and the `query_budget` fixture that fails a block running more statements
+than allowed.
+"""
+
+import os
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List
+
+import pytest
+
+# The settings are read when src is first imported
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='atrium-tests-')}/tests.sqlite")
+os.environ.setdefault("DATABASE_STARTUP", "create")
+os.environ.setdefault("JWT_SECRET_KEY", "tests")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("JWT_EXPIRATION", "15")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("METRICS_ENABLED", "false")
+# Nothing served from the shared cache, which would hide an N+1
+os.environ.setdefault("CACHE_TTL", "0")
+
+PASSWORD = "password1!"
+
+# (users, accepted friends of the probe user, friend requests it received)
+SIZES = {"small": (50, 5, 20), "large": (2_000, 200, 60)}
+
+
+@dataclass
+class World:
+
+    """
+    Users and friendships seeded for a test module, around a probe user whose friends and received friend
+    requests grow with the size. Tests that write take what they need from `strangers` and `pending`.
+    """
+
+    size: str
+    probe: Dict
+    admin: Dict
+    friends: List[uuid.UUID]
+    strangers: List[uuid.UUID]
+    pending: List[uuid.UUID]
+    headers: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    refresh_tokens: Dict[str, str] = field(default_factory=dict)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from main import create_app
+
+    with TestClient(create_app()) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def api():
+    from src.core.config import settings
+
+    return settings.API_V1_STR
+
+
+def seed_world(size: str) -> World:
+    """
+    Insert the users and friendships straight into the database, then recompute the friendship counters and
+    the friend suggestions.
+    """
+    from sqlalchemy import insert
+
+    from src.core.security import pwd_context
+    from src.core.suggestions import suggestion_engine
+    from src.crud.friends import get_friendship_edges
+    from src.crud.stats import reconcile_friendship_stats
+    from src.database.session import SessionLocal
+    from src.models.friends import Friendship, FriendshipStatus, canonical_pair
+    from src.models.user import User, Role
+
+    users, friends, pending = SIZES[size]
+    run = uuid.uuid4().hex[:8]
+    password = pwd_context.hash(PASSWORD)
+    now = datetime.now()
+
+    rows = [dict(id=uuid.uuid4(), firstname="Test", lastname="User", username=f"t{run}u{i}",
+                 email=f"t{run}u{i}@example.com", password=password, role=Role.ADMIN if i == 1 else Role.USER)
+            for i in range(users)]
+    probe, admin, others = rows[0], rows[1], [row["id"] for row in rows[2:]]
+
+    friendships = []
+    for i, other in enumerate(others[:friends + pending]):
+        low, high = canonical_pair(other, probe["id"])
+        accepted = i < friends
+        friendships.append(dict(id=uuid.uuid4(), created=now, user_id=other, receiver_id=probe["id"],
+                                pair_low_id=low, pair_high_id=high,
+                                status=FriendshipStatus.ACCEPTED if accepted else FriendshipStatus.PENDING,
+                                responded=now if accepted else None))
+    # Every other user befriends its neighbour, so the friends of the probe have friends to suggest
+    for first, second in zip(others[::2], others[1::2]):
+        low, high = canonical_pair(first, second)
+        friendships.append(dict(id=uuid.uuid4(), created=now, user_id=first, receiver_id=second,
+                                pair_low_id=low, pair_high_id=high, status=FriendshipStatus.ACCEPTED,
+                                responded=now))
+
+    with SessionLocal() as db:
+        for table, table_rows in ((User, rows), (Friendship, friendships)):
+            for start in range(0, len(table_rows), 5_000):
+                db.execute(insert(table), table_rows[start:start + 5_000])
+        db.commit()
+        reconcile_friendship_stats(db)
+        # The app only rebuilds the suggestions on its schedule, and the inserts don't ask for a rebuild
+        suggestion_engine.rebuild(lambda: get_friendship_edges(db))
+
+    return World(size=size, probe=probe, admin=admin, friends=others[:friends],
+                 strangers=others[friends + pending:],
+                 pending=[friendship["id"] for friendship in friendships[friends:friends + pending]])
+
+
+@pytest.fixture(scope="session", params=list(SIZES))
+def world(request, client, api) -> World:
+    """
+    A seeded world per size, logged in as its probe user and its admin.
+    """
+    world = seed_world(request.param)
+    for name, user in (("probe", world.probe), ("admin", world.admin)):
+        response = client.post(f"{api}/token/", data=dict(username=user["username"], password=PASSWORD))
+        response.raise_for_status()
+        world.headers[name] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        world.refresh_tokens[name] = response.json()["refresh_token"]
+    return world
+
+
+@pytest.fixture
+def query_budget():
+    """
+    The query_budget context manager: `with query_budget(2, "label"):` fails the test with the statements
+    listed when the block runs more than 2 of them, on any engine, from any thread.
+    """
+    from src.database.instrumentation import query_budget
+
+    return query_budget
@@ -0,0 +1,49 @@
+"""
+POST /users/bulk rejects uploads that are not UTF-8 before importing anything, and reads CSV records whose
+quoted fields span lines.
+"""
+
+import json
+import uuid
+
+from tests.conftest import PASSWORD
+
+
+def user_row(username: str) -> dict:
+    return dict(firstname="Bulk", lastname="User", username=username, email=f"{username}@example.com",
+                password=PASSWORD)
+
+
+def test_invalid_utf8_is_rejected_before_anything_is_imported(client, api, world):
+    run = uuid.uuid4().hex[:8]
+    lines = [json.dumps(user_row(f"b{run}u{i}")).encode() for i in range(3)]
+    lines.insert(2, b'{"firstname": "Bad\xff"}')
+
+    response = client.post(f"{api}/users/bulk", headers=world.headers["admin"], content=b"\n".join(lines))
+    assert response.status_code == 400
+    assert "offset" in response.json()["detail"]
+
+    response = client.get(f"{api}/users/", headers=world.headers["admin"],
+                          params=dict(search_type="username", search_query=f"b{run}"))
+    assert response.status_code == 404
+
+
+def test_csv_fields_may_span_lines(client, api, world):
+    run = uuid.uuid4().hex[:8]
+    first, second = user_row(f"c{run}u0"), user_row(f"c{run}u1")
+    body = "\r\n".join([
+        "firstname,lastname,username,email,password,note",
+        ",".join([*first.values(), '"a note\non two lines, with a comma"']),
+        "",
+        ",".join([*second.values(), "plain"]),
+        "Bulk,User,short",
+    ])
+
+    response = client.post(f"{api}/users/bulk", headers={**world.headers["admin"], "Content-Type": "text/csv"},
+                           content=body.encode())
+    response.raise_for_status()
+    report = response.json()
+
+    assert report["created"] == 2
+    # Numbered by line, the record with the multi-line note took lines 2 and 3
+    assert [error["row"] for error in report["errors"]] == [6]
@@ -0,0 +1,94 @@
+"""
+A read that started before a write committed can't leave its result in the shared cache for later reads.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def cache_ttl(monkeypatch):
+    from src.core.cache import shared_cache
+    from src.core.config import settings
+
+    monkeypatch.setattr(settings, "CACHE_TTL", 60)
+    yield
+    # The other modules count statements with nothing served from the shared cache
+    shared_cache.values.clear()
+
+
+def test_friend_ids_cached_before_an_accept_are_not_served_after_it(client, api, world, cache_ttl, monkeypatch):
+    from src.core.cache import shared_cache
+    from src.crud.friends import get_friend_ids
+    from src.database.session import SessionLocal
+
+    friend_request_id = world.pending.pop()
+    set_many = shared_cache.set_many
+
+    def accept_then_set_many(items, ttl):
+        # The accept commits between the reader's query and its cache write
+        monkeypatch.setattr(shared_cache, "set_many", set_many)
+        client.put(f"{api}/friends/requests/{friend_request_id}", headers=world.headers["probe"],
+                   params=dict(action="accept")).raise_for_status()
+        set_many(items, ttl)
+
+    monkeypatch.setattr(shared_cache, "set_many", accept_then_set_many)
+    with SessionLocal() as db:
+        stale = get_friend_ids(db, world.probe["id"])
+    with SessionLocal() as db:
+        fresh = get_friend_ids(db, world.probe["id"])
+
+    assert len(fresh) == len(stale) + 1
+
+
+def test_profiles_cached_before_a_change_are_not_served_after_it(client, api, world, cache_ttl, monkeypatch):
+    from src.core.cache import shared_cache
+    from src.crud.user import UserLoader
+    from src.database.session import SessionLocal
+    from src.models.user import State
+
+    user_id = world.strangers.pop()
+    set_many = shared_cache.set_many
+
+    def deactivate_then_set_many(items, ttl):
+        monkeypatch.setattr(shared_cache, "set_many", set_many)
+        client.put(f"{api}/users/state", headers=world.headers["admin"],
+                   params=dict(user_id=str(user_id), action="deactivate")).raise_for_status()
+        set_many(items, ttl)
+
+    monkeypatch.setattr(shared_cache, "set_many", deactivate_then_set_many)
+    with SessionLocal() as db:
+        stale, = UserLoader(db).load_many([user_id])
+    with SessionLocal() as db:
+        fresh, = UserLoader(db).load_many([user_id])
+
+    assert stale.state == State.ACTIVE
+    assert fresh.state == State.INACTIVE
+
+
+def test_principals_loaded_before_a_deactivation_are_not_served_after_it(client, api, world, monkeypatch):
+    import asyncio
+
+    from src.core import authentication
+    from src.database.session import SessionLocal
+    from src.models.user import State, User
+
+    user_id = world.strangers.pop()
+    load_principal = authentication.load_principal
+
+    def load_then_deactivate(session, user_identifier):
+        # The deactivation commits between the lookup's load and its cache write
+        user = load_principal(session, user_identifier)
+        monkeypatch.setattr(authentication, "load_principal", load_principal)
+        client.put(f"{api}/users/state", headers=world.headers["admin"],
+                   params=dict(user_id=str(user_id), action="deactivate")).raise_for_status()
+        return user
+
+    monkeypatch.setattr(authentication, "load_principal", load_then_deactivate)
+    with SessionLocal() as db:
+        token = authentication.create_access_token(db.get(User, user_id))
+        stale = asyncio.run(authentication.get_current_user(token, db))
+    with SessionLocal() as db:
+        fresh = asyncio.run(authentication.get_current_user(token, db))
+
+    assert stale.state == State.ACTIVE
+    assert fresh.state == State.INACTIVE
@@ -0,0 +1,45 @@
+"""
+Revoked access token claims live in the shared cache, whatever the size of the in-process caches.
+"""
+
+import asyncio
+import time
+
+from src.core.cache import MemoryBackend
+
+
+def test_stamps_are_not_evicted_by_values():
+    backend = MemoryBackend(maxsize=2)
+    backend.stamp("claims_changed:a", ttl=60)
+    backend.set_many({f"user:{i}": b"{}" for i in range(10)}, ttl=60)
+
+    stamp, missing = backend.stamps(["claims_changed:a", "claims_changed:b"])
+    assert stamp is not None and abs(stamp - time.time()) < 5
+    assert missing is None
+
+
+def test_stamps_expire():
+    backend = MemoryBackend(maxsize=0)
+    backend.stamp("claims_changed:a", ttl=0.01)
+    time.sleep(0.02)
+    assert backend.stamps(["claims_changed:a"]) == [None]
+
+
+def test_revoked_claims_are_not_trusted(world):
+    from src.core.authentication import create_access_token, get_current_principal, revoke_claims
+    from src.database.session import SessionLocal
+    from src.models.user import User
+    from src.schemas.token import Principal
+
+    with SessionLocal() as db:
+        user = db.get(User, world.admin["id"])
+        token = create_access_token(user)
+
+        assert isinstance(asyncio.run(get_current_principal(token, db)), Principal)
+
+        revoke_claims(user.id)
+        # Loaded from the database instead of trusting the claims
+        assert isinstance(asyncio.run(get_current_principal(token, db)), User)
+
+        time.sleep(1)
+        assert isinstance(asyncio.run(get_current_principal(create_access_token(user), db)), Principal)
@@ -0,0 +1,76 @@
+"""
+The ETags of /users/me, /friends/ and /friends/requests change with what the response shows, and only with that.
+"""
+
+from src.models.user import ProfileType
+
+
+def set_type(user_id, profile_type: ProfileType):
+    from src.crud.user import change_type
+    from src.database.session import SessionLocal
+    from src.models.user import User
+
+    with SessionLocal() as db:
+        change_type(db, db.get(User, user_id), profile_type)
+
+
+def test_me_changed_while_it_is_resolved_is_not_tagged_as_current(client, api, world, monkeypatch):
+    from src.core import authentication
+    from src.database.session import SessionLocal
+    from src.models.user import User
+
+    user_id = world.strangers.pop()
+    with SessionLocal() as db:
+        headers = {"Authorization": f"Bearer {authentication.create_access_token(db.get(User, user_id))}"}
+    load_principal = authentication.load_principal
+
+    def load_then_change(session, user_identifier):
+        # The change commits after the profile was loaded, before the response goes out
+        user = load_principal(session, user_identifier)
+        monkeypatch.setattr(authentication, "load_principal", load_principal)
+        set_type(user_id, ProfileType.PRIVATE)
+        return user
+
+    monkeypatch.setattr(authentication, "load_principal", load_then_change)
+    response = client.get(f"{api}/users/me", headers=headers)
+    assert response.json()["type"] == ProfileType.PUBLIC.value
+
+    response = client.get(f"{api}/users/me", headers={**headers, "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 200
+    assert response.json()["type"] == ProfileType.PRIVATE.value
+
+
+def test_friends_etag_follows_the_profiles_of_friends_only(client, api, world):
+    def etag():
+        return client.get(f"{api}/friends/", headers=world.headers["probe"]).headers["ETag"]
+
+    before = etag()
+    set_type(world.strangers.pop(), ProfileType.PRIVATE)
+    assert etag() == before
+
+    set_type(world.friends[0], ProfileType.PRIVATE)
+    try:
+        assert etag() != before
+    finally:
+        set_type(world.friends[0], ProfileType.PUBLIC)
+
+
+def test_friend_requests_etag_follows_the_profiles_of_senders_only(client, api, world):
+    from src.database.session import SessionLocal
+    from src.models.friends import Friendship
+
+    with SessionLocal() as db:
+        sender_id = db.get(Friendship, world.pending[-1]).user_id
+
+    def etag():
+        return client.get(f"{api}/friends/requests", headers=world.headers["probe"]).headers["ETag"]
+
+    before = etag()
+    set_type(world.strangers.pop(), ProfileType.PRIVATE)
+    assert etag() == before
+
+    set_type(sender_id, ProfileType.PRIVATE)
+    try:
+        assert etag() != before
+    finally:
+        set_type(sender_id, ProfileType.PUBLIC)
@@ -0,0 +1,45 @@
+"""
+An event stream only holds one of the worker's slots while its body is being sent.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+
+def test_a_stream_dropped_before_its_body_starts_holds_no_slot(world):
+    from src.api.v1.endpoints.friends import get_friend_request_events
+    from src.core.events import event_hub
+
+    before = event_hub.connections
+    principal = SimpleNamespace(id=world.probe["id"])
+
+    async def open_and_drop():
+        # The client disconnects before the response body starts, the body is never iterated
+        response = await get_friend_request_events(principal)
+        assert response.status_code == 200
+
+    asyncio.run(open_and_drop())
+    assert event_hub.connections == before
+
+
+def test_a_stream_releases_its_slot_when_it_ends(world):
+    from src.core.events import event_hub
+
+    async def stream_then_close():
+        stream = event_hub.stream(world.probe["id"])
+        await stream.__anext__()
+        opened = event_hub.connections
+        await stream.aclose()
+        return opened
+
+    before = event_hub.connections
+    assert asyncio.run(stream_then_close()) == before + 1
+    assert event_hub.connections == before
+
+
+def test_a_full_hub_answers_503(client, api, world, monkeypatch):
+    from src.core.events import event_hub
+
+    monkeypatch.setattr(event_hub, "max_connections", event_hub.connections)
+    response = client.get(f"{api}/friends/events", headers=world.headers["probe"])
+    assert response.status_code == 503
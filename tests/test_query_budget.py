@@ -0,0 +1,89 @@
+"""
+SQL statement budgets of the API endpoints. Every endpoint runs against each seeded world size with the same
+budget, so an endpoint whose statements grow with its rows (an N+1) fails on the large world.
+"""
+
+import pytest
+
+from tests.conftest import PASSWORD
+
+# Statements allowed per request, with the caches that outlive a request warm
+READ_BUDGETS = {
+    "users_me": 0,
+    "users": 1,
+    "users_search": 1,
+    "users_batch": 1,
+    "friends": 2,
+    "friend_requests": 2,
+    "friend_stats": 1,
+    "friend_suggestions": 1,
+    "friends_log": 2,
+}
+
+
+def read_request(client, api, world, name):
+    probe, admin = world.headers["probe"], world.headers["admin"]
+    requests = {
+        "users_me": lambda: client.get(f"{api}/users/me", headers=probe),
+        "users": lambda: client.get(f"{api}/users/", headers=probe),
+        "users_search": lambda: client.get(f"{api}/users/", headers=probe,
+                                           params=dict(search_type="username", search_query="u1")),
+        "users_batch": lambda: client.get(f"{api}/users/batch", headers=probe,
+                                          params=dict(ids=",".join(str(user_id) for user_id in world.friends))),
+        "friends": lambda: client.get(f"{api}/friends/", headers=probe),
+        "friend_requests": lambda: client.get(f"{api}/friends/requests", headers=probe),
+        "friend_stats": lambda: client.get(f"{api}/friends/stats", headers=probe),
+        "friend_suggestions": lambda: client.get(f"{api}/friends/suggestions", headers=probe),
+        "friends_log": lambda: client.get(f"{api}/friends/log", headers=admin),
+    }
+    return requests[name]()
+
+
+@pytest.mark.parametrize("name", list(READ_BUDGETS))
+def test_read_budget(client, api, world, query_budget, name):
+    # The first call fills the caches that outlive a request, e.g. the suggestions matrix
+    read_request(client, api, world, name).raise_for_status()
+
+    with query_budget(READ_BUDGETS[name], f"{name} ({world.size})"):
+        read_request(client, api, world, name).raise_for_status()
+
+
+def test_login_budget(client, api, world, query_budget):
+    with query_budget(3, f"token ({world.size})"):
+        response = client.post(f"{api}/token/", data=dict(username=world.probe["username"], password=PASSWORD))
+    response.raise_for_status()
+
+
+def test_refresh_budget(client, api, world, query_budget):
+    with query_budget(5, f"token_refresh ({world.size})"):
+        response = client.post(f"{api}/token/refresh", data=dict(refresh_token=world.refresh_tokens["admin"]))
+    response.raise_for_status()
+    world.refresh_tokens["admin"] = response.json()["refresh_token"]
+
+
+def test_send_friend_request_budget(client, api, world, query_budget):
+    receiver_id = world.strangers.pop()
+    with query_budget(6, f"send_friend_request ({world.size})"):
+        response = client.post(f"{api}/friends/requests", headers=world.headers["probe"],
+                               params=dict(receiver_id=str(receiver_id)))
+    response.raise_for_status()
+
+
+@pytest.mark.parametrize("action", ["accept", "reject", None])
+def test_respond_friend_request_budget(client, api, world, query_budget, action):
+    friend_request_id = world.pending.pop()
+    params = dict(action=action) if action else {}
+    with query_budget(5, f"respond_friend_request {action} ({world.size})"):
+        response = client.put(f"{api}/friends/requests/{friend_request_id}", headers=world.headers["probe"],
+                              params=params)
+    response.raise_for_status()
+
+
+@pytest.mark.parametrize("action", ["accept", "reject"])
+def test_respond_friend_requests_in_bulk_budget(client, api, world, query_budget, action):
+    friend_request_ids = [str(world.pending.pop()) for _ in range(5)]
+    with query_budget(4, f"respond_friend_requests_in_bulk {action} ({world.size})"):
+        response = client.put(f"{api}/friends/requests", headers=world.headers["probe"],
+                              json=dict(ids=friend_request_ids, action=action))
+    response.raise_for_status()
+    assert {result["result"] for result in response.json()} == {f"{action}ed"}
@@ -0,0 +1,133 @@
+"""
+RedisBackend against fakeredis: the token bucket script, the counters and their epoch, pub/sub across
+backends and its recovery from a lost connection, and calls from the event loop going to the threadpool.
+"""
+
+import asyncio
+import threading
+import time
+
+import fakeredis
+import pytest
+from sqlalchemy.util import greenlet_spawn
+
+from src.core.cache import RedisBackend
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_backend(server) -> RedisBackend:
+    backend = RedisBackend("", client=fakeredis.FakeRedis(server=server))
+    backend.RECONNECT_DELAY = 0.05
+    return backend
+
+
+@pytest.fixture
+def backend(server):
+    backend = make_backend(server)
+    yield backend
+    backend.close()
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_take_empties_and_refills_the_bucket(backend):
+    assert backend.take("bucket", rate=10, burst=2) == 0
+    assert backend.take("bucket", rate=10, burst=2) == 0
+
+    retry_after = backend.take("bucket", rate=10, burst=2)
+    assert 0 < retry_after <= 0.1
+    # A cost of 0 only checks, it doesn't take
+    assert backend.take("bucket", rate=10, burst=2, cost=0) > 0
+
+    time.sleep(retry_after + 0.02)
+    assert backend.take("bucket", rate=10, burst=2, cost=0) == 0
+    assert backend.take("bucket", rate=10, burst=2) == 0
+    assert backend.take("bucket", rate=10, burst=2) > 0
+
+
+def test_take_is_shared_by_the_workers(server):
+    first, second = make_backend(server), make_backend(server)
+    assert first.take("bucket", rate=1, burst=1) == 0
+    assert second.take("bucket", rate=1, burst=1) > 0
+
+
+def test_counters_start_over_under_a_new_epoch(backend):
+    epoch, counters = backend.counters(["a", "b"])
+    assert counters == [0, 0]
+
+    backend.incr("a", "b")
+    backend.incr("a")
+    assert backend.counters(["a", "b"]) == (epoch, [2, 1])
+
+    backend._redis.flushall()
+    new_epoch, counters = backend.counters(["a", "b"])
+    assert counters == [0, 0]
+    assert new_epoch != epoch
+
+
+def test_values_and_stamps(backend):
+    backend.set_many({"a": b"1", "b": b"2"}, ttl=60)
+    backend.set_many({"c": b"3"}, ttl=0)
+    assert backend.get_many(["a", "b", "c"]) == [b"1", b"2", None]
+
+    backend.delete("a")
+    assert backend.get_many(["a"]) == [None]
+
+    backend.stamp("claims_changed:a", ttl=60)
+    stamp, missing = backend.stamps(["claims_changed:a", "claims_changed:b"])
+    assert abs(stamp - time.time()) < 5
+    assert missing is None
+
+
+def test_messages_reach_every_backend(server, backend):
+    other = make_backend(server)
+    received = []
+    other.subscribe("topic", received.append)
+
+    # The listener subscribes on its own thread, publish until it is there
+    assert wait_for(lambda: backend.publish("topic", "ping") or received)
+    assert set(received) == {"ping"}
+    other.close()
+
+
+def test_messages_arrive_again_after_a_disconnect(server, backend):
+    received = []
+    backend.subscribe("topic", received.append)
+    assert wait_for(lambda: backend.publish("topic", "before") or received)
+
+    server.connected = False
+    time.sleep(0.2)
+    server.connected = True
+
+    assert wait_for(lambda: backend.publish("topic", "after") or "after" in received)
+    assert backend._listener.is_alive()
+
+
+def test_calls_from_the_event_loop_run_in_the_threadpool(backend, monkeypatch):
+    threads = []
+    mget = backend._redis.mget
+
+    def recording_mget(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return mget(*args, **kwargs)
+
+    monkeypatch.setattr(backend._redis, "mget", recording_mget)
+
+    async def main():
+        # How run_db runs CRUD code on an AsyncSession
+        return threading.get_ident(), await greenlet_spawn(backend.get_many, ["a"])
+
+    loop_thread, values = asyncio.run(main())
+    assert values == [None]
+    assert threads and loop_thread not in threads
@@ -0,0 +1,22 @@
+"""
+Friend suggestions come from the current mutual-friend matrix while a rebuild is due; requests never rebuild it.
+"""
+
+import pytest
+
+
+def test_requests_do_not_rebuild_the_matrix(client, api, world, monkeypatch):
+    from src.core.suggestions import suggestion_engine
+
+    before = client.get(f"{api}/friends/suggestions", headers=world.headers["probe"])
+    before.raise_for_status()
+
+    # Due for a rebuild, which only the background task may run
+    monkeypatch.setattr(suggestion_engine, "_dirty", True)
+    monkeypatch.setattr(suggestion_engine, "_built_at", 0.0)
+    monkeypatch.setattr(suggestion_engine, "build", lambda edges: pytest.fail("A request rebuilt the matrix"))
+    assert suggestion_engine.needs_build()
+
+    after = client.get(f"{api}/friends/suggestions", headers=world.headers["probe"])
+    assert after.json() == before.json()
+
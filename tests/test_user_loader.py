@@ -0,0 +1,36 @@
+"""
+The request-scoped UserLoader resolves any number of users with a constant number of statements.
+"""
+
+from src.database.instrumentation import capture_queries
+
+
+def test_friendships_log_statements_do_not_grow_with_the_page(client, api, world):
+    counts = []
+    for limit in (1, 10, 40):
+        with capture_queries() as captured:
+            response = client.get(f"{api}/friends/log", headers=world.headers["admin"], params=dict(limit=limit))
+        response.raise_for_status()
+        assert len(response.json()["items"]) == limit
+        counts.append(len(captured))
+
+    # The page, then every sender and receiver on it with one IN query
+    assert counts == [2, 2, 2]
+
+
+def test_load_many_is_one_query(world):
+    from src.crud.user import UserLoader
+    from src.database.session import SessionLocal
+
+    user_ids = [world.probe["id"], world.admin["id"], *world.friends, *world.strangers]
+    for count in (1, 10, len(user_ids)):
+        with SessionLocal() as db:
+            loader = UserLoader(db)
+            with capture_queries() as captured:
+                users = loader.load_many(user_ids[:count])
+                # Already loaded users are served by the loader itself
+                loader.load_many(user_ids[:count])
+                loader.load(user_ids[0])
+
+        assert [user.id for user in users] == user_ids[:count]
+        assert len(captured) == 1